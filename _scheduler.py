@@ -1,9 +1,31 @@
 import subprocess
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import sys
+import time
+import fcntl
+import importlib
+import argparse
+import traceback
 import yaml
 import calendar
 
+# once (cron):   python3 _scheduler.py
+#                runs the scripts as separate processes, their output shows up as it's printed
+# daemon:        python3 _scheduler.py --daemon
+#                stays up and runs them every day at schedule_time (settings.yaml) inside this
+#                process, so python, the YAML and pysnmp are only loaded once, and the sweep threads
+#                (more_python/async_sweep.py) keep their SNMP engines from one run to the next.
+#                sweep_processes workers are still started fresh for every finder run
+# either way only one run happens at a time (output/scheduler.lock), a run that finds the lock
+# taken is skipped
+
+base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+lock_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output', 'scheduler.lock')
+
+find_printers_path = os.path.join(base_path, '_find_printers.py')
+printer_counter_path = os.path.join(base_path, '_printer_counter.py')
+
 # Load settings from the YAML file
 def load_settings():
     settings_path = os.path.join(os.path.dirname(__file__), 'settings.yaml')
@@ -11,22 +33,35 @@ def load_settings():
         return yaml.safe_load(file)
 
 def run_script(script_path):
-    process = subprocess.run(['python3', script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    print(process.stdout)
+    # stdout and stderr of the script line by line while it runs, not all at the end
+    process = subprocess.Popen(['python3', '-u', script_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in process.stdout:
+        print(line, end='', flush=True)
+    process.wait()
     if process.returncode != 0:
-        print(f"Error running {script_path}: {process.stderr}")
-
-def main():
-    settings = load_settings()
-    dayToRunBoth = settings.get('dayToRunBoth')
+        print(f"Error running {script_path}: exited with {process.returncode}")
 
-    today = datetime.today().day
-    current_year = datetime.today().year
-    current_month = datetime.today().month
+# the same script, but in this process: import it (cheap, it only defines things) and call its
+# main(). the more_python modules (and pysnmp with them) stay imported between runs
+def run_script_in_process(script_path):
+    from more_python import metrics, snmp_client
+    metrics.reset()
+    snmp_client.new_run()
+    try:
+        module = importlib.import_module(os.path.splitext(os.path.basename(script_path))[0])
+        module.main()
+    except SystemExit as error:
+        if error.code not in (None, 0):
+            print(f"Error running {script_path}: exited with {error.code}")
+    except Exception:
+        print(f"Error running {script_path}:")
+        traceback.print_exc(file=sys.stdout)
 
+# which scripts to run on a given date
+def scripts_for(date, dayToRunBoth):
     # Get the number of days in the current month
-    days_in_month = calendar.monthrange(current_year, current_month)[1]
-    print(f"Today is {today}, dayToRunBoth is {dayToRunBoth}, days in month is {days_in_month}")
+    days_in_month = calendar.monthrange(date.year, date.month)[1]
+    print(f"Today is {date.day}, dayToRunBoth is {dayToRunBoth}, days in month is {days_in_month}")
 
     # Adjust dayToRunBoth to be within the valid range
     if dayToRunBoth > days_in_month:
@@ -35,22 +70,76 @@ def main():
         dayToRunBoth = 1
     print(f"Adjusted dayToRunBoth is {dayToRunBoth}")
 
-    base_path = os.path.join(os.path.dirname(__file__), 'src')
+    if date.day == dayToRunBoth:
+        print("------running both scripts today")
+        return [find_printers_path, printer_counter_path]
+    print("------running only printer counter today")
+    return [printer_counter_path]
 
-    find_printers_path = os.path.join(base_path, '_find_printers.py')
-    printer_counter_path = os.path.join(base_path, '_printer_counter.py')
+# None if another run has the lock
+def take_lock():
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    return lock_file
 
-    if today == dayToRunBoth:
-        print("------running both scripts today")
-        run_script(find_printers_path)
-        print("find printers complete.")
-        print("running printer counter")
-        run_script(printer_counter_path)
-        print("all complete")
+def run_day(settings, runner):
+    lock_file = take_lock()
+    if lock_file is None:
+        print(f"another run is still going ({lock_path}), skipping this one")
+        return
+    try:
+        for script_path in scripts_for(datetime.today(), settings.get('dayToRunBoth')):
+            print(f"running {os.path.basename(script_path)}", flush=True)
+            runner(script_path)
+            print(f"{os.path.basename(script_path)} complete", flush=True)
+        print("all complete", flush=True)
+    finally:
+        lock_file.close()
+
+# the next time it's schedule_time ("HH:MM"), today if that's still ahead
+def next_run(schedule_time, now):
+    hour, minute = (int(part) for part in str(schedule_time).split(':'))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+def daemon(settings):
+    # live output even when stdout is a file or a pipe (systemd, docker logs)
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.path.insert(0, base_path)
+    from more_python import snmp_client
+    snmp_client.load_pysnmp()  # pays for the pysnmp import now instead of in the first run
+
+    schedule_time = settings.get('schedule_time', '04:00')
+    if settings.get('run_at_start', False):
+        run_day(settings, run_script_in_process)
+    while True:
+        run_at = next_run(schedule_time, datetime.now())
+        print(f"next run at {run_at}")
+        # short sleeps so a clock change or a suspended machine doesn't throw it off
+        while datetime.now() < run_at:
+            time.sleep(min(60, max(1, (run_at - datetime.now()).total_seconds())))
+        run_day(settings, run_script_in_process)
+
+def main():
+    parser = argparse.ArgumentParser(description="runs the printer finder and the page counter")
+    parser.add_argument('--daemon', action='store_true', help="stay up and run every day at schedule_time")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    if args.daemon:
+        try:
+            daemon(settings)
+        except KeyboardInterrupt:
+            print("stopped")
     else:
-        print("------running only printer counter today")
-        run_script(printer_counter_path)
-        print("printer counter complete")
+        run_day(settings, run_script)
 
 if __name__ == "__main__":
     main()
@@ -1,29 +1,118 @@
+// talks to src/_web_api.py through nginx (/api/), one page of printers at a time
+const PER_PAGE = 50;
+let state = { month: null, page: 1, q: '' };
+
 document.addEventListener('DOMContentLoaded', () => {
-    fetch('/foundprinters/printers_2024-05.csv')
-        .then(response => response.text())
-        .then(data => {
-            const filename = 'printers_2024-05.csv';
-            document.getElementById('filename').innerText = filename;
-
-            const rows = data.split('\n').map(row => row.split(','));
-            let table = '<table border="1">';
-            rows.forEach(row => {
-                table += '<tr>';
-                row.forEach(cell => {
-                    if (isValidIP(cell)) {
-                        table += `<td><a href="http://${cell}" target="_blank">${cell}</a></td>`;
-                    } else {
-                        table += `<td>${cell}</td>`;
-                    }
-                });
-                table += '</tr>';
-            });
-            table += '</table>';
-            document.getElementById('csvTable').innerHTML = table;
-        });
+    document.getElementById('month').addEventListener('change', event => {
+        state.month = event.target.value;
+        state.page = 1;
+        loadDevices();
+    });
+
+    let typing;
+    document.getElementById('filter').addEventListener('input', event => {
+        clearTimeout(typing);
+        typing = setTimeout(() => {
+            state.q = event.target.value.trim();
+            state.page = 1;
+            loadDevices();
+        }, 250);
+    });
+
+    document.getElementById('prev').addEventListener('click', () => { state.page--; loadDevices(); });
+    document.getElementById('next').addEventListener('click', () => { state.page++; loadDevices(); });
+
+    loadMonths();
 });
 
-function isValidIP(str) {
-    const pattern = /^(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$/;
-    return pattern.test(str);
+function getJSON(url) {
+    return fetch(url).then(response => {
+        if (!response.ok) {
+            return response.json().then(body => { throw new Error(body.error || response.statusText); });
+        }
+        return response.json();
+    });
+}
+
+function loadMonths() {
+    getJSON('/api/months').then(data => {
+        const select = document.getElementById('month');
+        select.replaceChildren();
+        data.months.filter(month => month.found_printers).forEach(month => {
+            select.appendChild(new Option(month.month, month.month));
+        });
+        if (select.options.length) {
+            state.month = select.options[0].value;
+            loadDevices();
+        } else {
+            showMessage('no foundprinters files yet');
+        }
+    }).catch(error => showMessage(error.message));
+}
+
+function loadDevices() {
+    const params = new URLSearchParams({ month: state.month, page: state.page, per_page: PER_PAGE });
+    if (state.q) {
+        params.set('q', state.q);
+    }
+    getJSON(`/api/devices?${params}`).then(data => {
+        document.getElementById('filename').innerText = `foundprinters_${data.month}.csv`;
+        document.getElementById('pageInfo').innerText = `page ${data.page} of ${data.pages} (${data.total} printers)`;
+        document.getElementById('prev').disabled = data.page <= 1;
+        document.getElementById('next').disabled = data.page >= data.pages;
+
+        const table = document.createElement('table');
+        table.appendChild(row('th', ['IP', 'Model', 'Serial', 'Hostname', 'b/w', 'color', 'counted']));
+        data.devices.forEach(device => {
+            const tr = row('td', ['', device.model, '', device.hostname, device.bw ?? '', device.color ?? '', device.counted ?? '']);
+            tr.cells[0].appendChild(link(`http://${device.ip}`, device.ip, '_blank'));
+            if (device.serial) {
+                const serial = link('#', device.serial);
+                serial.addEventListener('click', event => { event.preventDefault(); loadHistory(device.serial); });
+                tr.cells[2].appendChild(serial);
+            }
+            table.appendChild(tr);
+        });
+        document.getElementById('csvTable').replaceChildren(table);
+    }).catch(error => showMessage(error.message));
+}
+
+function loadHistory(serial) {
+    getJSON(`/api/devices/${encodeURIComponent(serial)}/history`).then(data => {
+        const table = document.createElement('table');
+        table.appendChild(row('th', ['Date', 'IP', 'Model', 'b/w', 'color']));
+        data.readings.forEach(reading => {
+            table.appendChild(row('td', [reading.ts, reading.ip, reading.model, reading.bw ?? '', reading.color ?? '']));
+        });
+        const history = document.getElementById('history');
+        const title = document.createElement('h2');
+        title.innerText = `history: ${serial}`;
+        history.replaceChildren(title, table);
+    }).catch(error => {
+        document.getElementById('history').innerText = error.message;
+    });
+}
+
+function row(cellTag, values) {
+    const tr = document.createElement('tr');
+    values.forEach(value => {
+        const cell = document.createElement(cellTag);
+        cell.innerText = value;
+        tr.appendChild(cell);
+    });
+    return tr;
+}
+
+function link(href, text, target) {
+    const a = document.createElement('a');
+    a.href = href;
+    a.innerText = text;
+    if (target) {
+        a.target = target;
+    }
+    return a;
+}
+
+function showMessage(message) {
+    document.getElementById('csvTable').innerText = message;
 }
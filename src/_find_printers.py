@@ -1,34 +1,26 @@
 import os
-import subprocess
+import sys
 import yaml
 from datetime import datetime, timedelta
-from pysnmp.hlapi import *
 import time
 import socket
+import argparse
+import subprocess
 
-
-
-
-from more_python.time_formatter import format_elapsed_time  
-timestart = datetime.now()
-
-# Import is_printer function from the new script
-from more_python.find_printers_filter import is_printer
-
-# Define OIDs for different printer data
-SERIAL_OIDS = [
-    ".1.3.6.1.2.1.43.5.1.1.17.1",  # General printer serial number OID
-    ".1.3.6.1.4.1.2385.1.1.5.1.1.1",  # Konica Minolta specific OID (example)
-    ".1.3.6.1.4.1.1347.41.1.1.1.1.4.0"  # Ecosys specific OID (example)
-]
-MODEL_OID = ".1.3.6.1.2.1.1.1.0"  # OID for the printer model
-HOSTNAME_OID = ".1.3.6.1.2.1.1.5.0"  # OID for the printer hostname
-
-#count number of IP addresses to do
-ipAddressesTotal = 0
-ipAddressesRemaining = 0
-ipAddressesDone = 0
-
+from more_python.time_formatter import format_elapsed_time
+from more_python.finder import generate_ips_in_subnet, is_skipped_ip, probe_ip, find_responders
+from more_python.async_sweep import sweep
+from more_python.process_sweep import ProcessSweep, available_cores
+from more_python import snmp_client
+from more_python import rate_limit
+from more_python.device_index import DeviceIndex
+from more_python.log_sink import LogSink, sink_settings
+from more_python import distributed_scan
+from more_python import neighbor_prefilter
+from more_python import metrics
+
+# the probing itself lives in more_python/finder.py (from more_python import discover),
+# this script reads settings.yaml and keeps the foundprinters CSV and the logs
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -37,14 +29,16 @@ config_file = os.path.normpath(os.path.join(script_dir, '../settings.yaml'))
 # Output directories
 output_dir = os.path.normpath(os.path.join(script_dir, '../output'))
 logs_dir = os.path.join(output_dir, 'logs')
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(logs_dir, exist_ok=True)
 
-with open(config_file, 'r') as file:
-    config = yaml.safe_load(file)
+stylizedSleep = 0.1
+
+
+def load_config():
+    with open(config_file, 'r') as file:
+        return yaml.safe_load(file)
 
 # Function to get a configuration value with default and missing key handling
-def get_config_value(key, default=None, required=False):
+def get_config_value(config, key, default=None, required=False):
     if key in config:
         return config[key]
     elif required:
@@ -54,222 +48,301 @@ def get_config_value(key, default=None, required=False):
         #print(f"{key} variable not found in settings.yaml, defaulting to {default}")
         return default
 
-# Load configuration values
-debug_mode = get_config_value('debug', False)
-subnets = get_config_value('subnets', required=True)
-known_printers = get_config_value('knownprinters', required=True)
-date_filename_offset = -get_config_value('DateFilenameOffset', 0)
-snmpv1_community = get_config_value('snmpv1_community', 'public')
-
-# Handling debug_date and debug_MM_YYYY
-if get_config_value('debug_date', False):
-    base_date = datetime.strptime(f"01-{get_config_value('debug_MM_YYYY', required=False)}", "%d-%m-%Y")
-else:
-    base_date = datetime.now()
-
-
-
-# Calculate the adjusted date based on offset
-adjusted_date = base_date + timedelta(days=date_filename_offset)
-adjusted_month_year = adjusted_date.strftime("%Y-%m")
-stylizedSleep = 0.1
-year = adjusted_date.strftime("%Y")
+# Function to print and log the result of probe_ip and update the CSV content.
+# erase=True overwrites the "polling..." line printed by scan_ip
+def record_result(current_ip, result, device_index, tlog, erase=True):
+    def status(line):
+        if erase:
+            print('\033[A\033[K', end='')
+        print(line)
 
-# Create a subdirectory for the year
-year_output_dir = os.path.join(output_dir, year)
-os.makedirs(year_output_dir, exist_ok=True)
+    if result[0] == "skipped":
+        status(f"{current_ip} \tskipped")
+        return
 
-# Get current month and year for file naming
-short_name = f"foundprinters_{adjusted_month_year}.csv"
-output_file = os.path.join(year_output_dir, short_name)
-print(">>>>>\t\t\t\t\t<<<<")
-time.sleep(stylizedSleep)
-print(f">>>>>\t{short_name}\t<<<<")
-time.sleep(stylizedSleep)
-print(">>>>>\t\t\t\t\t<<<<")
-time.sleep(stylizedSleep)
+    if result[0] == "no response":
+        status(f"{current_ip} \t?")
+        tlog.write(f"{current_ip} - ?\n", ip=current_ip, event="no response")
+        return
 
-# Get current month name for log file naming
-log_file = os.path.join(year_output_dir, f"log_{adjusted_month_year}.txt")
+    _, serial, model, hostname, is_printer_flag, returnString = result
+    #print(f"\t{current_ip} ----->> {is_printer_flag}, {returnString}")
+    if is_printer_flag:
+        if not serial:
+            tlog.write(f"{current_ip}: {returnString}- no serial - ?\n", ip=current_ip, event="printer", model=model)
+        else:
+            tlog.write(f"{current_ip}: {returnString}- {model} - {serial} - {hostname}\n",
+                       ip=current_ip, event="printer", model=model, serial=serial, hostname=hostname)
 
-# Today's log file
-todays_log = os.path.join(year_output_dir, "TodaysLog_FindPrinters.txt")
+                #  write to csv:
+        if serial and current_ip not in device_index:
+            status(f"{current_ip} \t{returnString}: {model} - {hostname}")
+            moved_from = device_index.ip_for_serial(serial)
+            if moved_from:
+                tlog.write(f"{current_ip}: serial {serial} was already found at {moved_from}\n",
+                           ip=current_ip, event="moved", serial=serial, moved_from=moved_from)
+            device_index.add(current_ip, model, serial, hostname)
+    else:
+        status(f"{current_ip} \t{returnString}: {model} - {hostname}")
+        tlog.write(f"{current_ip} \t{returnString}: {model} - {serial} - {hostname}\n",
+                   ip=current_ip, event="not a printer", model=model, serial=serial, hostname=hostname)
+
+# Function to scan a list of IPs. with max_in_flight > 1 the IPs are probed concurrently, with a
+# pool (sweep_processes) they're spread over several processes. results are still written in the order of the list
+def scan_ips(ips, settings, device_index, tlog, pool=None):
+    if pool:
+        pool.run(ips, lambda ip, result: record_result(ip, result, device_index, tlog, erase=False))
+        return
 
+    community = settings['community']
+    responders = None
+    if settings['host_discovery'] == 'snmp':
+        # one fast UDP pass over the whole list first, only the hosts that answer get the full probe
+        ips = list(ips)
+        responders = find_responders(
+            [ip for ip in ips if not is_skipped_ip(ip)], community,
+            settings['snmp_port'], settings['discovery_timeout'], settings['discovery_retries'])
+        print(f"{len(responders)} of {len(ips)} addresses answered SNMP")
+
+    if settings['max_in_flight'] <= 1:
+        for current_ip in ips:
+            print(f"{current_ip}   -   polling...", end="\n")
+            record_result(current_ip, probe_ip(current_ip, community, responders), device_index, tlog)
+    else:
+        sweep(ips, lambda ip: probe_ip(ip, community, responders),
+              lambda ip, result: record_result(ip, result, device_index, tlog, erase=False),
+              settings['max_in_flight'])
+
+# the scan settings, and the snmp_client ones set from settings.yaml
+def read_settings(config):
+    settings = {
+        'community': get_config_value(config, 'snmpv1_community', 'public'),
+        'max_in_flight': get_config_value(config, 'max_in_flight', 1),  # how many IPs to probe at once. 1 = one at a time
+        'sweep_processes': get_config_value(config, 'sweep_processes', 1),  # 1 = sweep in this process, 0 = one per core
+        'neighbor_prefilter': get_config_value(config, 'neighbor_prefilter', 'off'),  # off, first or only
+        'host_discovery': get_config_value(config, 'host_discovery', 'ping'),  # ping or snmp
+        'discovery_timeout': get_config_value(config, 'discovery_timeout', 1),
+        'discovery_retries': get_config_value(config, 'discovery_retries', 1),
+        'snmp_port': get_config_value(config, 'snmp_port', 161),  # only change this for testing against testing/snmp_simulator.py
+    }
+    # yaml reads a bare off/on as false/true
+    settings['neighbor_prefilter'] = {False: 'off', True: 'first'}.get(settings['neighbor_prefilter'],
+                                                                      settings['neighbor_prefilter'])
+    snmp_client.SNMP_PORT = settings['snmp_port']
+    # snmp request timeouts, see more_python/snmp_client.py
+    snmp_client.TIMEOUT = get_config_value(config, 'snmp_timeout', snmp_client.TIMEOUT)
+    snmp_client.RETRIES = get_config_value(config, 'snmp_retries', snmp_client.RETRIES)
+    snmp_client.MIN_TIMEOUT = get_config_value(config, 'snmp_min_timeout', snmp_client.MIN_TIMEOUT)
+    snmp_client.MAX_TIMEOUT = get_config_value(config, 'snmp_max_timeout', snmp_client.MAX_TIMEOUT)
+    snmp_client.HOST_FAIL_LIMIT = get_config_value(config, 'snmp_host_fail_limit', snmp_client.HOST_FAIL_LIMIT)
+    snmp_client.ADAPTIVE_TIMEOUTS = get_config_value(config, 'adaptive_timeouts', snmp_client.ADAPTIVE_TIMEOUTS)
+    # packets per second and requests per host, see more_python/rate_limit.py
+    rate_limit.configure(config)
+    return settings
+
+# finder.scan()'s arguments from the settings, what a worker scans each unit with
+def scan_settings(settings):
+    return {
+        'community': settings['community'],
+        'max_in_flight': max(1, settings['max_in_flight']),
+        'host_discovery': settings['host_discovery'],
+        'port': settings['snmp_port'],
+        'discovery_timeout': settings['discovery_timeout'],
+        'discovery_retries': settings['discovery_retries'],
+    }
+
+# --coordinator: hand the subnets out to workers and write what they find, see more_python/distributed_scan.py
+def coordinate(subnets, settings, config, device_index, log, tlog, local_workers):
+    units = distributed_scan.shard(subnets, get_config_value(config, 'scan_unit_size', 256))
+    host = get_config_value(config, 'scan_coordinator_host', '127.0.0.1')
+    port = get_config_value(config, 'scan_coordinator_port', 8082)
+    workers = []
+
+    def on_result(unit, printers):
+        for printer in printers:
+            result = ("polled", printer["serial"], printer["model"], printer["hostname"], True, printer["type"])
+            record_result(printer["ip"], result, device_index, tlog, erase=False)
+        device_index.flush()
+        line = f"{datetime.now().strftime('%H:%M:%S')} finished {unit['first']} - {unit['last']} ({unit['subnet']})\n"
+        log.write(line, event="unit finished", first=unit['first'], last=unit['last'])
+        tlog.write(line, event="unit finished", first=unit['first'], last=unit['last'])
+
+    def ready(address):
+        print(f"coordinator on {address[0]}:{address[1]}, {len(units)} units of up to "
+              f"{get_config_value(config, 'scan_unit_size', 256)} addresses")
+        worker_host = '127.0.0.1' if address[0] in ('0.0.0.0', '') else address[0]
+        for _ in range(local_workers):
+            workers.append(subprocess.Popen(
+                [sys.executable, os.path.realpath(__file__), '--worker', f"{worker_host}:{address[1]}"]))
+
+    coordinator = distributed_scan.Coordinator(units, on_result, get_config_value(config, 'scan_lease_timeout', 300))
+    try:
+        coordinator.serve(host, port, ready)
+        if coordinator.failed:
+            print(f"{len(coordinator.failed)} of {len(units)} units were given up on, their results couldn't be written")
+    finally:
+        for worker in workers:
+            try:
+                worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.terminate()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="finds the printers in the subnets from settings.yaml")
+    parser.add_argument('--coordinator', action='store_true',
+                        help="split the subnets into units and let workers scan them")
+    parser.add_argument('--local-workers', type=int, default=0, metavar='N',
+                        help="with --coordinator, also start N workers on this machine")
+    parser.add_argument('--worker', metavar='HOST:PORT', help="scan units for the coordinator at HOST:PORT")
+    return parser.parse_args(argv)
+
+def main(argv=()):
+    args = parse_args(argv)
+    timestart = datetime.now()
+    config = load_config()
+
+    if args.worker:
+        # only talks to the coordinator, nothing gets written here
+        settings = read_settings(config)
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        units = distributed_scan.run_worker(distributed_scan.parse_address(args.worker), name, scan_settings(settings))
+        print(f"worker {name}: scanned {units} units in {datetime.now() - timestart}")
+        return
 
-# Clear today's log file
-with open(todays_log, 'w'):
-    pass
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(logs_dir, exist_ok=True)
 
+    # Load configuration values
+    debug_mode = get_config_value(config, 'debug', False)
+    subnets = get_config_value(config, 'subnets', required=True)
+    known_printers = get_config_value(config, 'knownprinters', required=True)
+    date_filename_offset = -get_config_value(config, 'DateFilenameOffset', 0)
+    settings = read_settings(config)
 
-# Log the start of the script
-with open(log_file, 'a') as log, open(todays_log, 'a') as tlog:
+    # Handling debug_date and debug_MM_YYYY
+    if get_config_value(config, 'debug_date', False):
+        base_date = datetime.strptime(f"01-{get_config_value(config, 'debug_MM_YYYY', required=False)}", "%d-%m-%Y")
+    else:
+        base_date = datetime.now()
+
+    # Calculate the adjusted date based on offset
+    adjusted_date = base_date + timedelta(days=date_filename_offset)
+    adjusted_month_year = adjusted_date.strftime("%Y-%m")
+    year = adjusted_date.strftime("%Y")
+
+    # Create a subdirectory for the year
+    year_output_dir = os.path.join(output_dir, year)
+    os.makedirs(year_output_dir, exist_ok=True)
+
+    # Get current month and year for file naming
+    short_name = f"foundprinters_{adjusted_month_year}.csv"
+    output_file = os.path.join(year_output_dir, short_name)
+    print(">>>>>\t\t\t\t\t<<<<")
+    time.sleep(stylizedSleep)
+    print(f">>>>>\t{short_name}\t<<<<")
+    time.sleep(stylizedSleep)
+    print(">>>>>\t\t\t\t\t<<<<")
+    time.sleep(stylizedSleep)
+
+    # Get current month name for log file naming
+    log_file = os.path.join(year_output_dir, f"log_{adjusted_month_year}.txt")
+
+    # Today's log file
+    todays_log = os.path.join(year_output_dir, "TodaysLog_FindPrinters.txt")
+
+    # both stay open for the run and are written in the background, see more_python/log_sink.py.
+    # today's log starts empty, the monthly one is rotated once it's over log_max_bytes
+    log = LogSink(log_file, rotate=True, **sink_settings(config))
+    tlog = LogSink(todays_log, truncate=True, **sink_settings(config))
+
+    # Log the start of the script
     start_time = datetime.now().strftime("%I:%M %p - %d %B %Y")
-    log.write(f"***** {start_time} - starting script\n")
+    log.write(f"***** {start_time} - starting script\n", event="start")
     log.write(socket.gethostname())
     tlog.write(socket.gethostname())
-    tlog.write(f"***** {start_time} - starting script\n")
-
-# Function to get data from the printer using SNMP
-def get_printer_data(ip):
-    serial = ""
-    model = ""
-    hostname = ""
-
-    for oid in SERIAL_OIDS:
-        errorIndication, errorStatus, errorIndex, varBinds = next(
-            getCmd(SnmpEngine(),
-                   CommunityData(snmpv1_community, mpModel=0),
-                   UdpTransportTarget((ip, 161)),
-                   ContextData(),
-                   ObjectType(ObjectIdentity(oid)))
-        )
-
-        if errorIndication:
-            continue
-        elif errorStatus:
-            continue
-        else:
-            for varBind in varBinds:
-                serial = str(varBind[1])
-                if serial:
-                    break
-        if serial:
-            break
-
-    errorIndication, errorStatus, errorIndex, varBinds = next(
-        getCmd(SnmpEngine(),
-               CommunityData(snmpv1_community, mpModel=0),
-               UdpTransportTarget((ip, 161)),
-               ContextData(),
-               ObjectType(ObjectIdentity(MODEL_OID)))
-    )
-
-    if not errorIndication and not errorStatus:
-        for varBind in varBinds:
-            model = str(varBind[1])
-
-    errorIndication, errorStatus, errorIndex, varBinds = next(
-        getCmd(SnmpEngine(),
-               CommunityData(snmpv1_community, mpModel=0),
-               UdpTransportTarget((ip, 161)),
-               ContextData(),
-               ObjectType(ObjectIdentity(HOSTNAME_OID)))
-    )
-
-    if not errorIndication and not errorStatus:
-        for varBind in varBinds:
-            hostname = str(varBind[1])
-
-   
-    serial = serial.replace(",", " ")
-    model = model.replace(",", " ")
-    hostname = hostname.replace(",", " ")
-
-    max_length = 40
-    return serial, model[:max_length], hostname
-
-# Function to check if a printer is already in the CSV file
-def is_printer_in_csv(ip):
-    with open(output_file, 'r') as file:
-        return any(line.startswith(f"{ip},") for line in file)
-
-# Function to scan an IP address and update the CSV content
-def scan_ip(current_ip):
-    print(f"{current_ip}   -   polling...", end="\n")
-    
-    # Skip if IP is x.x.x.1 or x.x.x.255
-    if current_ip.endswith('.1') or current_ip.endswith('.255'):
-        print('\033[A\033[K', end='')
-        print(f"{current_ip} \tskipped", end="\n")
-        return
-    
-    response = subprocess.run(['ping', '-c', '1', '-W', '1', current_ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if response.returncode != 0:
-        print('\033[A\033[K', end='')
-        print(f"{current_ip} \t?")
-        with open(todays_log, 'a') as tlog:
-            tlog.write(f"{current_ip} - ?\n")
-        return
-
-    serial, model, hostname = get_printer_data(current_ip)
-    #print('\033[A\033[K', end='')
-
-    is_printer_flag, returnString = is_printer(current_ip, snmpv1_community)
-    #print(f"\t{current_ip} ----->> {is_printer_flag}, {returnString}")
-    if is_printer_flag:
-        with open(todays_log, 'a') as tlog:
-            if not serial:
-                tlog.write(f"{current_ip}: {returnString}- no serial - ?\n")
-            else:
-                tlog.write(f"{current_ip}: {returnString}- {model} - {serial} - {hostname}\n")
-                
-                #  write to csv:
-        if serial and not is_printer_in_csv(current_ip):
-            print('\033[A\033[K', end='')
-            print(f"{current_ip} \t{returnString}: {model} - {hostname}")
-            with open(output_file, 'a') as file:
-                file.write(f"{current_ip},{model},{serial},{hostname}\n")
-    else:
-        print('\033[A\033[K', end='')
-        print(f"{current_ip} \t{returnString}: {model} - {hostname}")
-        with open(todays_log, 'a') as tlog:
-            tlog.write(f"{current_ip} \t{returnString}: {model} - {serial} - {hostname}\n")
-
-# Initialize CSV file with headers if it doesn't exist
-if not os.path.isfile(output_file):
-    with open(output_file, 'w') as file:
-        file.write("ip,model,serial,hostname\n")
-
-# Function to generate IPs in a subnet
-def generate_ips_in_subnet(subnet):
-    import ipaddress
-    network = ipaddress.IPv4Network(subnet, strict=False)
-    for ip in network.hosts():
-        yield str(ip)
-
-# Main logic to decide which IPs to scan
-try:
-    if debug_mode:
-        for current_ip in known_printers:
-            scan_ip(current_ip)
-        with open(todays_log, 'a') as tlog:
+    tlog.write(f"***** {start_time} - starting script\n", event="start")
+
+    # Load this month's CSV once (creates it with headers if it doesn't exist)
+    device_index = DeviceIndex(output_file)
+
+    # worker processes for big sweeps, see more_python/process_sweep.py. started with the first subnet
+    pool = None
+    processes = settings['sweep_processes'] or available_cores()
+    if processes > 1 and not args.coordinator:
+        pool = ProcessSweep(processes, **scan_settings(settings))
+        print(f"sweeping with {processes} processes")
+
+    # hosts the ARP table or the lease dumps say are up get probed first, see more_python/neighbor_prefilter.py
+    live = None
+    if settings['neighbor_prefilter'] != 'off':
+        live = neighbor_prefilter.known_live(get_config_value(config, 'neighbor_table', '/proc/net/arp'),
+                                             get_config_value(config, 'lease_dumps', []))
+        print(f"{len(live)} addresses known to be up from the neighbor table and lease dumps")
+
+    # scan_ips() once per prefilter pass, the known ones first
+    def scan(ips):
+        for name, batch in neighbor_prefilter.passes(ips, live, settings['neighbor_prefilter']):
+            if name != "all":
+                tlog.write(f"{datetime.now().strftime('%H:%M:%S')} probing {name}: {len(batch)} addresses\n",
+                           event="prefilter pass", name=name, addresses=len(batch))
+            scan_ips(batch, settings, device_index, tlog, pool)
+
+    # Main logic to decide which IPs to scan
+    try:
+        if args.coordinator:
+            coordinate(known_printers if debug_mode else subnets, settings, config,
+                       device_index, log, tlog, args.local_workers)
+        elif debug_mode:
+            scan(known_printers)
             tlog.write(f"Results saved to {year_output_dir}\n")
-    else:
-        for subnet in subnets:
-            with open(log_file, 'a') as log, open(todays_log, 'a') as tlog:
-                log.write(f"{datetime.now().strftime('%H:%M:%S')} starting subnet {subnet}\n")
-                tlog.write(f"{datetime.now().strftime('%H:%M:%S')} starting subnet {subnet}\n")
+        else:
+            for subnet in subnets:
+                log.write(f"{datetime.now().strftime('%H:%M:%S')} starting subnet {subnet}\n", event="subnet started", subnet=subnet)
+                tlog.write(f"{datetime.now().strftime('%H:%M:%S')} starting subnet {subnet}\n", event="subnet started", subnet=subnet)
 
-            for current_ip in generate_ips_in_subnet(subnet):
-                scan_ip(current_ip)
+                scan(generate_ips_in_subnet(subnet))
+                device_index.flush()
 
-            with open(log_file, 'a') as log, open(todays_log, 'a') as tlog:
-                log.write(f"{datetime.now().strftime('%H:%M:%S')} finished subnet {subnet}\n")
-                tlog.write(f"{datetime.now().strftime('%H:%M:%S')} finished subnet {subnet}\n")
+                log.write(f"{datetime.now().strftime('%H:%M:%S')} finished subnet {subnet}\n", event="subnet finished", subnet=subnet)
+                tlog.write(f"{datetime.now().strftime('%H:%M:%S')} finished subnet {subnet}\n", event="subnet finished", subnet=subnet)
                 tlog.write(f"Results saved to {year_output_dir} for subnet {subnet}\n")
 
-    # Log the end of the script
-    with open(log_file, 'a') as log, open(todays_log, 'a') as tlog:
+        # Log the end of the script
         end_time = datetime.now().strftime("%I:%M %p - %d %b")
-        log.write(f"{end_time} - entire script finished\n")
-        tlog.write(f"{end_time} - entire script finished\n")
-
-    print(f"All subnets scanned. Results saved to {year_output_dir}")
+        log.write(f"{end_time} - entire script finished\n", event="finished")
+        tlog.write(f"{end_time} - entire script finished\n", event="finished")
 
-except KeyboardInterrupt:
-    print("\r")
-    print('\033[A\033[K', end='')
-    print("Process interrupted by user.")
+        print(f"All subnets scanned. Results saved to {year_output_dir}")
 
-# Get the end time
-timeend = datetime.now()
-elapsed_time = timeend - timestart
-formatted_elapsed_time = format_elapsed_time(elapsed_time, format_type=1)
-print(f"elapsed time: {elapsed_time}")
+    except KeyboardInterrupt:
+        print("\r")
+        print('\033[A\033[K', end='')
+        print("Process interrupted by user.")
+        if pool:
+            pool.terminate()
+
+    finally:
+        if pool:
+            pool.close()  # brings the workers' metrics back
+        # write out whatever printers are still buffered
+        device_index.flush()
+
+    # Get the end time
+    timeend = datetime.now()
+    elapsed_time = timeend - timestart
+    formatted_elapsed_time = format_elapsed_time(elapsed_time, format_type=1)
+    print(f"elapsed time: {elapsed_time}")
 
-# Log the end of the script
-with open(log_file, 'a') as log, open(todays_log, 'a') as tlog:
+    # Log the end of the script
     end_time = datetime.now().strftime("%I:%M %p - %d %b")
-    log.write(f"{end_time} - entire script finished in: {elapsed_time}\n")
-    tlog.write(f"{end_time} - entire script finished in: {elapsed_time}\n")
+    log.write(f"{end_time} - entire script finished in: {elapsed_time}\n", event="elapsed", seconds=elapsed_time.total_seconds())
+    tlog.write(f"{end_time} - entire script finished in: {elapsed_time}\n", event="elapsed", seconds=elapsed_time.total_seconds())
+    log.close()
+    tlog.close()
+
+    # where the time went: output/YYYY/metrics_FindPrinters.json and .prom
+    metrics.observe("run_seconds", elapsed_time.total_seconds())
+    metrics.save(year_output_dir, "FindPrinters")
 
+if __name__ == "__main__":
+    main(sys.argv[1:])
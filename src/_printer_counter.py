@@ -1,302 +1,226 @@
 import os
 import csv
-import subprocess
-from datetime import datetime, timedelta
-import pysnmp.hlapi as snmp
+import glob
+from datetime import datetime
 import re
 import yaml
 import socket
 
+from more_python.time_formatter import format_elapsed_time
+from more_python import snmp_client
+from more_python import rate_limit
+from more_python.async_sweep import sweep
+from more_python.counter import Counter
+from more_python.finder import find_responders
+from more_python.count_store import CountStore
+from more_python.log_sink import LogSink, sink_settings
+from more_python import metrics
+
+# reading the printers lives in more_python/counter.py (from more_python import collect_counts),
+# this script reads settings.yaml and keeps the count store, the totals CSV and the logs
+
 # Assuming the YAML file is in the same directory as the script
 script_dir = os.path.dirname(os.path.realpath(__file__))
 config_file = os.path.normpath(os.path.join(script_dir, '../settings.yaml'))
-from more_python.time_formatter import format_elapsed_time  
-
-# Get the start time
-timestart = datetime.now()
-print(f"Started at {timestart}")
-
-from more_python.is_color_printer import is_color_printer
 
 output_name = "output"
 output_directory = os.path.normpath(os.path.join(script_dir, f"../{output_name}"))
-
-################ settings.yaml ################
-# Load the YAML configuration
-with open(config_file, 'r') as file:
-    config = yaml.safe_load(file)
-
-# Load config from YAML
-debug = config.get('debug', False)
-known_printers = config.get('knownprinters', [])
-snmpv1_community = config['snmpv1_community']
-###############################################
-
-
-# Get the base date
-base_date = datetime.now()
-if config.get('debug_date', False):
-    base_date = datetime.strptime(f"01-{config.get('debug_MM_YYYY', required=False)}", "%d-%m-%Y")
-
-# Calculate the adjusted date based on offset 
-adjusted_year = base_date.strftime("%Y")
-
-# Create a subdirectory for the year
-year_output_dir = os.path.join(output_directory, adjusted_year)
-os.makedirs(year_output_dir, exist_ok=True)
-
-
-# Define filenames
-filename = f"totals_{base_date:%Y_%m}.csv"
-csvfile_path = os.path.join(year_output_dir, filename)
-todaysLog = os.path.join(year_output_dir, "TodaysLog_PrinterCounter.txt")
-
-# Clear the log file at the start of each run
-with open(todaysLog, "w"):
-    pass
-
-# Define a reusable logging function
-def logMessage(logfile, message):
-    with open(logfile, 'a') as log:
-        log.write(message + "\n")
-
-# Log the start of the script
-
-start_time = datetime.now().strftime("%I:%M %p - %d %B %Y")
-logMessage(todaysLog, f"***** {start_time} - starting script\n")
-logMessage(todaysLog, socket.gethostname())
-
-def sanitize_output(input_str):
-    truncated = input_str[:64]
-    sanitized = ''.join(e for e in truncated if e.isalnum() or e.isspace())
-    return sanitized
-
-def get_printer_model(ip):
-    model_oid = "1.3.6.1.2.1.25.3.2.1.3.1"  # Example OID for printer model; update this to the correct OID
-    model = snmp_get(ip, model_oid)
-#    model = model
-    return model if model is not None else ""
-
-def snmp_get(ip, oid):
-    errorIndication, errorStatus, errorIndex, varBinds = next(
-        snmp.getCmd(snmp.SnmpEngine(),
-#                    snmp.CommunityData(snmp_community),
-                    snmp.CommunityData(snmpv1_community),
-                    snmp.UdpTransportTarget((ip, 161)),
-                    snmp.ContextData(),
-                    snmp.ObjectType(snmp.ObjectIdentity(oid)))
-    )
-    if errorIndication:
-        return None
-    elif errorStatus:
-        return None
-    else:
-        for varBind in varBinds:
-            return varBind.prettyPrint().split('=')[-1].strip()
-    return None
-
-def get_printer_counts(ip, model):
-    is_color = is_color_printer(ip, model, snmpv1_community)  # Ensure model is passed
-
-    bw_oids = get_matching_oids(OIDS_bw_known, OIDS_bw, model, default_oid)
-    bw_count = try_snmp_get(ip, bw_oids)
-    print(f"        bw:    {bw_count}")
-    
-    #logMessage(todaysLog, f"        bw:     {count_bw}")
-
-    color_count = ""
-    if is_color:
-        color_oids = get_matching_oids(OIDS_color_known, OIDS_color, model, default_oid)
-        color_count = try_snmp_get(ip, color_oids)
-        print(f"        color: {color_count}")
-
-    return bw_count if bw_count is not None else "", color_count if color_count is not None else ""
-
-def get_matching_oids(known_oid_dict, oid_dict, model, default):
-    # Normalize the model string by converting to lowercase and removing spaces
-    normalized_model = model.lower().replace(" ", "")
-    
-    # First, try to find the model in the known OID dictionary
-    for key in known_oid_dict:
-        normalized_key = key.lower().replace(" ", "")
-        if normalized_key == normalized_model:
-            # Return the list of OIDs, excluding any "null" entries
-            return [oid for oid in known_oid_dict[key] if oid != "null"]
-
-    # If no match is found in the known OID dictionary, proceed to the secondary list
-    for keys in oid_dict:
-        # Split keys by comma and iterate over each possible match
-        for key in keys.split(','):
-            normalized_key = key.strip().lower().replace(" ", "")
-            if normalized_key in normalized_model:
-                return [oid for oid in oid_dict[keys] if oid != "null"]
-    
-    # If no match is found, return the default OID
-    return [default]
-
-def try_snmp_get(ip, oids):
-    for oid in oids:
-        response = snmp_get(ip, oid)
-        if response == "No Such Object currently exists at this OID":
-            response = None
-        if response:
-            return response
-    return None
-
-
-current_year = datetime.now().year
-current_month = datetime.now().month
-
-# Format the expected file name
-foundPrintersCSV = f"foundprinters_{base_date:%Y-%m}.csv"
-foundprinters_dir = os.path.normpath(os.path.join(script_dir, f"../{output_name}"))
-echo = f"searching: {foundprinters_dir}"
-expected_file_path = os.path.join(year_output_dir, foundPrintersCSV)
-
-printer_ips = []
-
-# Check if the expected file exists
-if debug:
-    print("Debug mode is ON. Skipping file check.")
-    # Example of what printer_ips might be in debug mode, replace with actual debug data if available
-    printer_ips = known_printers
-else:
-    print(f"searching: {expected_file_path}")
-    if os.path.exists(expected_file_path):
-        print(f"Using printers list from {expected_file_path}")
-        # Read the printer IPs from the CSV file (first column, starting from the second row)
-        with open(expected_file_path, newline='') as csvfile:
-            print(os.getcwd())
-            reader = csv.reader(csvfile)
-            printer_ips = [row[0] for row in list(reader)[1:]]
+cache_directory = os.path.join(output_directory, "cache")
+
+# Define a reusable logging function. log is a LogSink, fields go in the structured record
+def logMessage(log, message, **fields):
+    log.write(message + "\n", **fields)
+
+def main():
+    # Get the start time
+    timestart = datetime.now()
+    print(f"Started at {timestart}")
+
+    ################ settings.yaml ################
+    # Load the YAML configuration
+    with open(config_file, 'r') as file:
+        config = yaml.safe_load(file)
+
+    # Load config from YAML
+    debug = config.get('debug', False)
+    known_printers = config.get('knownprinters', [])
+    snmpv1_community = config['snmpv1_community']
+    host_discovery = config.get('host_discovery', 'ping')  # ping or snmp
+    discovery_timeout = config.get('discovery_timeout', 1)
+    discovery_retries = config.get('discovery_retries', 1)
+    snmp_port = config.get('snmp_port', 161)  # only change this for testing against testing/snmp_simulator.py
+    counter_workers = config.get('counter_workers', 1)  # how many printers to read at once. 1 = one at a time
+    bulk_walk_counts = config.get('bulk_walk_counts', False)  # read the standard Printer-MIB tables before the vendor OIDs
+    oid_tables_file = config.get('oid_tables')  # custom printer_oids.yaml, if not set the one in more_python is used
+    ###############################################
+
+    snmp_client.SNMP_PORT = snmp_port
+    # snmp request timeouts, see more_python/snmp_client.py
+    snmp_client.TIMEOUT = config.get('snmp_timeout', snmp_client.TIMEOUT)
+    snmp_client.RETRIES = config.get('snmp_retries', snmp_client.RETRIES)
+    snmp_client.MIN_TIMEOUT = config.get('snmp_min_timeout', snmp_client.MIN_TIMEOUT)
+    snmp_client.MAX_TIMEOUT = config.get('snmp_max_timeout', snmp_client.MAX_TIMEOUT)
+    snmp_client.HOST_FAIL_LIMIT = config.get('snmp_host_fail_limit', snmp_client.HOST_FAIL_LIMIT)
+    snmp_client.ADAPTIVE_TIMEOUTS = config.get('adaptive_timeouts', snmp_client.ADAPTIVE_TIMEOUTS)
+    # packets per second and requests per host, see more_python/rate_limit.py
+    rate_limit.configure(config)
+
+
+    # Get the base date
+    base_date = datetime.now()
+    if config.get('debug_date', False):
+        base_date = datetime.strptime(f"01-{config.get('debug_MM_YYYY', required=False)}", "%d-%m-%Y")
+
+    # Calculate the adjusted date based on offset 
+    adjusted_year = base_date.strftime("%Y")
+
+    # Create a subdirectory for the year
+    year_output_dir = os.path.join(output_directory, adjusted_year)
+    os.makedirs(year_output_dir, exist_ok=True)
+
+
+    # Define filenames
+    filename = f"totals_{base_date:%Y_%m}.csv"
+    csvfile_path = os.path.join(year_output_dir, filename)
+    # started empty each run, kept open and written in the background (more_python/log_sink.py)
+    todaysLog = LogSink(os.path.join(year_output_dir, "TodaysLog_PrinterCounter.txt"), truncate=True,
+                        **sink_settings(config))
+
+    # Log the start of the script
+
+    start_time = datetime.now().strftime("%I:%M %p - %d %B %Y")
+    logMessage(todaysLog, f"***** {start_time} - starting script\n")
+    logMessage(todaysLog, socket.gethostname())
+
+    current_year = datetime.now().year
+    current_month = datetime.now().month
+
+    # Format the expected file name
+    foundPrintersCSV = f"foundprinters_{base_date:%Y-%m}.csv"
+    foundprinters_dir = os.path.normpath(os.path.join(script_dir, f"../{output_name}"))
+    echo = f"searching: {foundprinters_dir}"
+    expected_file_path = os.path.join(year_output_dir, foundPrintersCSV)
+
+    printer_ips = []
+
+    # Check if the expected file exists
+    if debug:
+        print("Debug mode is ON. Skipping file check.")
+        # Example of what printer_ips might be in debug mode, replace with actual debug data if available
+        printer_ips = known_printers
     else:
-        print(f"ln120: can't open ({foundPrintersCSV}) in {expected_file_path}")
-        exit(1)
-
-
-# known OIDs fr bw and color. move to module someday.
-OIDS_bw_known = {
-    "KONICA MINOLTA bizhub C368": ["1.3.6.1.4.1.18334.1.1.1.5.7.2.2.1.5.1.2"],
-    "ECOSYS M3860idn": ["iso.3.6.1.4.1.1347.42.3.1.1.1.1.1"],
-    "ECOSYS M5526cdw": ["iso.3.6.1.4.1.1347.42.3.1.2.1.1.1.1"],
-    "ECOSYS M6235cidn": ["iso.3.6.1.4.1.1347.42.3.1.2.1.1.1.1"],
-    "ECOSYS P6235cdn": ["iso.3.6.1.4.1.1347.42.2.2.1.1.3.1.1"],
-    "ECOSYS M3655idn": ["iso.3.6.1.4.1.1347.42.3.1.1.1.1.1"],
-    "ECOSYS P6230cdn": ["iso.3.6.1.4.1.1347.42.2.2.1.1.3.1.1"],
-    "Source Technologies ST9820": ["iso.3.6.1.4.1.641.6.4.2.1.1.4.1.2"]
-}
-
-OIDS_color_known = {
-    "KONICA MINOLTA bizhub C368": ["1.3.6.1.4.1.18334.1.1.1.5.7.2.2.1.5.2.2"],
-    "ECOSYS M5526cdw": ["iso.3.6.1.4.1.1347.42.3.1.2.1.1.1.2"],
-    "ECOSYS P6235cdn": ["iso.3.6.1.4.1.1347.42.2.2.1.1.3.1.2"],
-    "ECOSYS P6230cdn": ["iso.3.6.1.4.1.1347.42.2.2.1.1.3.1.2"]
-}
-
-# guesses to fall back on 
-OIDS_bw = {
-    "HP": ["null"],
-    "Integrated": ["1.3.6.1.4.1.12345.1.1"],
-    "KONICA, minolta, bizhub": ["1.3.6.1.4.1.18334.1.1.1.5.7.2.2.1.5.1.2", "1.3.6.1.4.1.1347.42.3.1.1.1.1.1"], #good so far
-    "ecosys, kyocera": ["1.3.6.1.4.1.1347.43.10.1.1.12.1.1", "1.3.6.1.4.1.1347.42.3.1.2.1.1.1.1", "1.3.6.1.4.1.1347.42.2.1.1.1.6.1.6"], #not good
-    "Source": ["null"],
-    "Canon": ["1.3.6.1.4.1.789.2.1"]
-}
-
-OIDS_color = {
-    "HP": ["1.3.6.1.2.1.43.10.2.1.5.1.1"],
-    "Integrated": ["1.3.6.1.4.1.12345.1.2"],
-    "KONICA, minolta, bizhub": ["1.3.6.1.4.1.18334.1.1.1.5.7.2.2.1.5.2.2"],
-    "ecosys, kyocera": ["1.3.6.1.4.1.1347.43.10.1.1.13.1.1"],
-    "Source": ["null"],
-    "Canon": ["1.3.6.1.4.1.789.2.2"]
-}
-
-oid_serial = [
-    "1.3.6.1.2.1.43.5.1.1.17.1"
-]
-
-default_oid = "1.3.6.1.2.1.43.10.2.1.4.1.1"
-
-# Prepare the header for CSV file
-header = "IP:"
-model_row = "Model"
-type_row = "Date,Time"
-
-for ip in printer_ips:
-    header += f",{ip},{ip}"
-    type_row += ",b/w,color"
-
-# Prepare the row for serial numbers and page counts
-serials_row = "Serial"
-counts_row = f"{datetime.now():%Y-%m-%d},{datetime.now():%H:%M:%S}"
-
-for ip in printer_ips:
-    # Ping the IP address
-    response = subprocess.run(['ping', '-c', '1', '-W', '1', ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if response.returncode != 0:
-        
-        
-        response = f"pinging {{ip}} - No response..."
-        print(response)
-        logMessage(todaysLog, response)
-        
-        serials_row += ","
-        counts_row += ",,"
-        model_row += ","
-        continue
+        print(f"searching: {expected_file_path}")
+        if os.path.exists(expected_file_path):
+            print(f"Using printers list from {expected_file_path}")
+            # Read the printer IPs from the CSV file (first column, starting from the second row)
+            with open(expected_file_path, newline='') as csvfile:
+                print(os.getcwd())
+                reader = csv.reader(csvfile)
+                printer_ips = [row[0] for row in list(reader)[1:]]
+        else:
+            print(f"ln120: can't open ({foundPrintersCSV}) in {expected_file_path}")
+            exit(1)
+
+
+    # every reading goes into output/page_counts.sqlite3, totals_YYYY_MM.csv is exported from it at the end
+    count_store = CountStore(os.path.join(output_directory, "page_counts.sqlite3"))
+    store_month = f"{base_date:%Y-%m}"
+    run_timestamp = f"{datetime.now():%Y-%m-%d %H:%M:%S}"
+
+    # totals files from before the store existed get loaded once, so the export doesn't lose them
+    for old_csv in sorted(glob.glob(os.path.join(output_directory, "*", "totals_*.csv"))):
+        match = re.match(r"totals_(\d{4})_(\d{2})\.csv$", os.path.basename(old_csv))
+        if match and not count_store.has_month(f"{match.group(1)}-{match.group(2)}"):
+            imported = count_store.import_wide_csv(f"{match.group(1)}-{match.group(2)}", old_csv)
+            logMessage(todaysLog, f"imported {imported} readings from {old_csv}")
+
+    # with host_discovery: snmp every printer is checked with one UDP pass up front instead of a ping each
+    responders = None
+    if host_discovery == 'snmp':
+        responders = find_responders(printer_ips, snmpv1_community, snmp_port, discovery_timeout, discovery_retries)
+
+    # reads the printers, see more_python/counter.py. which OIDs worked and which printers are color
+    # are kept in output/cache between runs
+    counter = Counter(snmpv1_community, cache_directory, oid_tables_file, bulk_walk_counts,
+                      unknown_models_log=os.path.join(year_output_dir, "unknown_models.txt"), responders=responders)
+    counter.timestamp = run_timestamp
+
+    # Function to print/log one printer's reading and add it to the count store.
+    # always called in printer_ips order so the log reads the same as the one-at-a-time loop
+    def record_printer(ip, reading):
+        # a reading with no counts still goes in the store, it keeps the printer's column in the export
+        count_store.add(store_month, reading)
+
+        if not reading.answered:
+
+
+            response = f"pinging {{ip}} - No response..."
+            print(response)
+            logMessage(todaysLog, response, ip=ip, event="no response")
+            return
+        else:
+            print(f"pinging {ip} - ")
+
+        count_bw = "" if reading.bw is None else reading.bw
+        count_color = "" if reading.color is None else reading.color
+        response2 = f"        model: {reading.model}"
+        print(response2)
+        logMessage(todaysLog, response2, ip=ip, event="model", model=reading.model)
+
+        print(f"        Serial: {reading.serial}")
+
+        print(f"        bw:    {count_bw}")
+        if count_color != "":
+            print(f"        color: {count_color}")
+        logMessage(todaysLog, f"        bw:     {count_bw}", ip=ip, event="bw", bw=reading.bw)
+        logMessage(todaysLog, f"        Col:    {count_color}", ip=ip, event="color", color=reading.color)
+        logMessage(todaysLog, f"        serial: {reading.serial}", ip=ip, event="serial", serial=reading.serial)
+
+    if counter_workers <= 1:
+        for ip in printer_ips:
+            record_printer(ip, counter.collect(ip))
     else:
-        print(f"pinging {ip} - ")
-
-    # Get printer model
-    model = get_printer_model(ip)
-    response2 = f"        model: {model}"
-    print(response2)
-    logMessage(todaysLog, response2)
-    model_row += f",{model},"
-
-    # Query serial number
-    print(f"        Serial: ", end='')
-    serial = try_snmp_get(ip, oid_serial)
-    serial = sanitize_output(serial) if serial is not None else ""
-    print(serial)
-    serials_row += f",{serial}, <--"
-
-    # Get printer counts
-    count_bw, count_color = get_printer_counts(ip, model)
-    logMessage(todaysLog, f"        bw:     {count_bw}")
-    logMessage(todaysLog, f"        Col:    {count_color}")
-    logMessage(todaysLog, f"        serial: {serial}")
-
-    # Append counts to counts row
-    counts_row += f",{count_bw},{count_color}"
-
-
-# Check if the file already exists
-if os.path.exists(csvfile_path):
-    print("Appending totals to CSV...")
-    with open(csvfile_path, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(counts_row.split(','))
-else:
-    print("Creating new CSV...")
-    with open(csvfile_path, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([f"{datetime.now():%b %Y}"] + header.split(','))
-        writer.writerow([''] + model_row.split(','))
-        writer.writerow([''] + serials_row.split(','))
-        writer.writerow(type_row.split(','))
-        writer.writerow(counts_row.split(','))
-
-print(f"Totals written to: {filename}")
-logMessage(todaysLog, f"Totals written to: {filename}")
-
-# Get the end time
-timeend = datetime.now()
-#time began
-logMessage(todaysLog, f"        started:    {timestart}")
-logMessage(todaysLog, f"        finished:   {timeend}")
-elapsed_time = timeend - timestart
-formatted_elapsed_time = format_elapsed_time(elapsed_time, format_type=1)
-print(f"All done in {elapsed_time}")
-logMessage(todaysLog, f"         total time: {elapsed_time}")
\ No newline at end of file
+        # dead printers cost seconds of timeouts each, so read many at once
+        sweep(printer_ips, counter.collect, record_printer, counter_workers)
+
+    counter.save()
+
+
+    # all of this run's readings in one transaction, then the month's totals CSV is rewritten from the store
+    with metrics.timed("store_write"):
+        count_store.flush()
+
+    print("Writing totals CSV...")
+    with metrics.timed("csv_write", file="totals"):
+        count_store.export_wide_csv(store_month, csvfile_path)
+
+    # pages printed this month per printer, model and subnet, only months with new readings are worked out again
+    usage_path = os.path.join(year_output_dir, f"usage_{store_month}.csv")
+    with metrics.timed("usage_rollup"):
+        from more_python.usage_rollup import UsageRollup  # imported here, numpy alone takes a few hundred ms to load
+        usage_rollup = UsageRollup(count_store, os.path.join(cache_directory, "usage_rollups.json"))
+        usage_written = usage_rollup.write_csv(store_month, usage_path)
+    count_store.close()
+    if usage_written:
+        logMessage(todaysLog, f"Usage written to: {os.path.basename(usage_path)}")
+
+    print(f"Totals written to: {filename}")
+    logMessage(todaysLog, f"Totals written to: {filename}")
+
+    # Get the end time
+    timeend = datetime.now()
+    #time began
+    logMessage(todaysLog, f"        started:    {timestart}")
+    logMessage(todaysLog, f"        finished:   {timeend}")
+    elapsed_time = timeend - timestart
+    formatted_elapsed_time = format_elapsed_time(elapsed_time, format_type=1)
+    print(f"All done in {elapsed_time}")
+    logMessage(todaysLog, f"         total time: {elapsed_time}", event="elapsed", seconds=elapsed_time.total_seconds())
+    todaysLog.close()
+
+    # where the time went: output/YYYY/metrics_PrinterCounter.json and .prom
+    metrics.observe("run_seconds", elapsed_time.total_seconds())
+    metrics.save(year_output_dir, "PrinterCounter")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# JSON API for the web interface, serves what's in output/ so the page doesn't have to
+# download and split whole CSV files in the browser.
+#
+#   GET /api/months                        months that have a foundprinters list or page counts
+#   GET /api/devices?month=YYYY-MM&page=1&per_page=50&q=text
+#                                          printers found that month (+ their last page count),
+#                                          q filters on ip/model/serial/hostname
+#   GET /api/devices/<serial>/history?start=YYYY-MM-DD&end=YYYY-MM-DD
+#                                          every page count reading for one printer
+#
+# Responses are gzipped when the browser asks for it and carry an ETag/Last-Modified made from
+# the mtimes of the files they came from, so a reload with nothing new is a 304.
+# Parsed files are kept in memory until their mtime changes.
+#
+# run:  python3 src/_web_api.py    (web_api_host / web_api_port in settings.yaml, 127.0.0.1:8081 by default)
+# nginx proxies /api/ to it, see src-web-interface/nginx.conf
+
+import csv
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import traceback
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import yaml
+
+from more_python.count_store import CountStore
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+config_file = os.path.normpath(os.path.join(script_dir, '../settings.yaml'))
+output_dir = os.path.normpath(os.path.join(script_dir, '../output'))
+store_path = os.path.join(output_dir, "page_counts.sqlite3")
+
+MAX_PER_PAGE = 500
+MAX_CACHE_ENTRIES = 1000
+GZIP_MIN_BYTES = 1024
+
+
+def load_config():
+    if not os.path.exists(config_file):
+        return {}
+    with open(config_file, 'r') as file:
+        return yaml.safe_load(file) or {}
+
+
+# ---- files and the cache ----
+
+# mtime_ns of a file, 0 if it isn't there. the store's -wal file changes on every write
+def mtime_of(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def store_mtime():
+    return max(mtime_of(store_path), mtime_of(store_path + "-wal"))
+
+
+def found_printers_files():
+    files = {}
+    for path in glob.glob(os.path.join(output_dir, "*", "foundprinters_*.csv")):
+        match = re.search(r"foundprinters_(\d{4}-\d{2})\.csv$", path)
+        if match:
+            files[match.group(1)] = path
+    return files
+
+
+# (key, mtimes) -> value, anything made from files whose mtimes changed is just made again
+class FileCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, mtimes, build):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == mtimes:
+                return entry[1]
+        value = build()
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= MAX_CACHE_ENTRIES:
+                del self.entries[next(iter(self.entries))]  # oldest first
+            self.entries[key] = (mtimes, value)
+        return value
+
+
+cache = FileCache()
+
+
+def read_found_printers(path):
+    devices = []
+    with open(path, newline='') as file:
+        for row in list(csv.reader(file))[1:]:
+            if row:
+                row += [""] * (4 - len(row))
+                devices.append({"ip": row[0], "model": row[1], "serial": row[2], "hostname": row[3]})
+    return devices
+
+
+def open_store():
+    return CountStore(store_path, readonly=True) if os.path.exists(store_path) else None
+
+
+def store_months():
+    store = open_store()
+    if store is None:
+        return []
+    try:
+        return store.months()
+    finally:
+        store.close()
+
+
+# ---- endpoints, each returns (data, mtimes of the files it used) ----
+
+def api_months(query):
+    files = found_printers_files()
+    mtimes = (store_mtime(),) + tuple(sorted((month, mtime_of(path)) for month, path in files.items()))
+
+    def build():
+        counted = set(store_months())
+        months = sorted(set(files) | counted, reverse=True)
+        return [{"month": month, "found_printers": month in files, "page_counts": month in counted} for month in months]
+
+    return {"months": cache.get("months", mtimes, build)}, mtimes
+
+
+def api_devices(query):
+    files = found_printers_files()
+    month = query.get("month") or (max(files) if files else None)
+    path = files.get(month)
+    if path is None:
+        raise NotFound(f"no foundprinters list for {month}")
+
+    try:
+        page = max(1, int(query.get("page", 1)))
+        per_page = min(MAX_PER_PAGE, max(1, int(query.get("per_page", 50))))
+    except ValueError:
+        raise BadRequest("page and per_page have to be numbers")
+    text = (query.get("q") or "").lower()
+
+    mtimes = (mtime_of(path), store_mtime())
+
+    def build():
+        devices = read_found_printers(path)
+        store = open_store()
+        latest = {}
+        if store is not None:
+            try:
+                latest = store.latest_readings(month)
+            finally:
+                store.close()
+        # the counter keeps only letters and digits of a serial, so fall back to the IP
+        by_ip = {reading.ip: reading for reading in latest.values()}
+        for device in devices:
+            reading = latest.get(device["serial"]) if device["serial"] else None
+            reading = reading or by_ip.get(device["ip"])
+            device["bw"] = reading.bw if reading else None
+            device["color"] = reading.color if reading else None
+            device["counted"] = reading.ts if reading else None
+            # lowercase text to filter on, dropped before sending
+            device["_text"] = " ".join((device["ip"], device["model"], device["serial"], device["hostname"])).lower()
+        return devices
+
+    devices = cache.get(("devices", month), mtimes, build)
+    if text:
+        devices = [device for device in devices if text in device["_text"]]
+
+    start = (page - 1) * per_page
+    return {
+        "month": month,
+        "total": len(devices),
+        "page": page,
+        "per_page": per_page,
+        "pages": max(1, -(-len(devices) // per_page)),
+        "devices": [{key: value for key, value in device.items() if key != "_text"}
+                    for device in devices[start:start + per_page]],
+    }, mtimes
+
+
+def api_history(query, serial):
+    mtimes = (store_mtime(),)
+    start, end = query.get("start"), query.get("end")
+
+    def build():
+        store = open_store()
+        if store is None:
+            return []
+        try:
+            readings = store.history(serial, start, end)
+            if not readings:
+                # the counter keeps only letters, digits and spaces of a serial (sanitize_output)
+                readings = store.history(''.join(c for c in serial[:64] if c.isalnum() or c.isspace()), start, end)
+            return [{"ts": reading.ts, "ip": reading.ip, "model": reading.model, "bw": reading.bw, "color": reading.color}
+                    for reading in readings]
+        finally:
+            store.close()
+
+    readings = cache.get(("history", serial, start, end), mtimes, build)
+    if not readings:
+        raise NotFound(f"no readings for {serial}")
+    return {"serial": serial, "readings": readings}, mtimes
+
+
+class NotFound(Exception):
+    status = 404
+
+
+class BadRequest(Exception):
+    status = 400
+
+
+# ---- http ----
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "PrinterFinderAPI"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+
+        try:
+            history = re.fullmatch(r"/api/devices/([^/]+)/history", path)
+            if path == "/api/months":
+                data, mtimes = api_months(query)
+            elif path == "/api/devices":
+                data, mtimes = api_devices(query)
+            elif history:
+                data, mtimes = api_history(query, unquote(history.group(1)))
+            else:
+                raise NotFound(f"unknown endpoint {path}")
+        except (NotFound, BadRequest) as error:
+            self.send_json(error.status, {"error": str(error)})
+            return
+        except Exception:
+            # anything else is a bug or a broken file in output/, log it and keep the answer JSON
+            print(f"error answering GET {self.path}:")
+            traceback.print_exc()
+            self.send_json(500, {"error": "internal error"})
+            return
+
+        # same files + same query = same answer
+        etag = '"' + hashlib.sha1(repr((url.path, sorted(query.items()), mtimes)).encode()).hexdigest()[:20] + '"'
+        newest = max([stamp for stamp in mtimes if isinstance(stamp, int)] +
+                     [stamp[1] for stamp in mtimes if isinstance(stamp, tuple)] + [0])
+        last_modified = formatdate(newest / 1e9, usegmt=True) if newest else None
+
+        if self.not_modified(etag, newest):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            if last_modified:
+                self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return
+
+        self.send_json(200, data, {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"})
+
+    def not_modified(self, etag, newest):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since and newest:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return datetime.fromtimestamp(newest / 1e9, timezone.utc).replace(microsecond=0) <= since
+        return False
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Vary", "Accept-Encoding")
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            if value:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if debug:
+            super().log_message(format, *args)
+
+
+config = load_config()
+debug = config.get('debug', False)
+
+if __name__ == "__main__":
+    host = config.get('web_api_host', '127.0.0.1')
+    port = config.get('web_api_port', 8081)
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"serving {output_dir} on http://{host}:{port}/api/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("stopped")
@@ -2,4 +2,5 @@ sudo mv /usr/lib/python3.11/EXTERNALLY-MANAGED /usr/lib/python3.11/EXTERNALLY
 -MANAGED.old
 pip install pysnmp pyyaml
 pip install pyYAML
+pip install numpy
 #install re
\ No newline at end of file
@@ -0,0 +1,22 @@
+# more_python/__init__.py
+
+# from more_python import discover, collect_counts
+# the modules behind these are only imported when they're first used, so importing the package
+# (or just one helper from it) stays cheap
+
+_lazy = {
+    'discover': 'more_python.finder',
+    'collect_counts': 'more_python.counter',
+    'Counter': 'more_python.counter',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        value = getattr(importlib.import_module(_lazy[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,72 @@
+# more_python/async_sweep.py
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_size = 0
+_executor_lock = threading.Lock()
+
+
+# One thread pool for every sweep in the process, so the threads (and the SnmpEngine snmp_client
+# keeps on each of them) live across subnets, scripts and _scheduler.py --daemon runs instead of
+# being built again for every sweep. A sweep that wants more threads than the pool has gets a bigger one.
+def _get_executor(size):
+    global _executor, _executor_size
+    with _executor_lock:
+        if _executor is None or _executor_size < size:
+            old = _executor
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sweep")
+            _executor_size = size
+            if old is not None:
+                old.shutdown(wait=False)
+        return _executor
+
+
+# Probe many hosts at once but hand the results back in the order the IPs were given,
+# so the csv and TodaysLog come out the same as the old one-at-a-time loop.
+# probe(ip) is the blocking part (ping + snmp) and runs on a worker thread,
+# on_result(ip, result) runs on the event loop thread in IP order.
+async def sweep_async(ips, probe, on_result, max_in_flight=32):
+    max_in_flight = max(1, int(max_in_flight))
+    loop = asyncio.get_running_loop()
+    executor = _get_executor(max_in_flight)
+    slots = asyncio.Semaphore(max_in_flight)
+
+    finished = {}  # index -> (ip, result) waiting for earlier IPs to finish
+    next_to_emit = 0
+    tasks = set()
+
+    def emit_ready():
+        nonlocal next_to_emit
+        while next_to_emit in finished:
+            ip, result = finished.pop(next_to_emit)
+            on_result(ip, result)
+            next_to_emit += 1
+
+    async def run_one(index, ip):
+        try:
+            result = await loop.run_in_executor(executor, probe, ip)
+        finally:
+            slots.release()
+        finished[index] = (ip, result)
+        emit_ready()
+
+    try:
+        # only create a task once a slot is free, so a /16 doesn't queue 65k tasks up front
+        for index, ip in enumerate(ips):
+            await slots.acquire()
+            task = asyncio.create_task(run_one(index, ip))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def sweep(ips, probe, on_result, max_in_flight=32):
+    asyncio.run(sweep_async(ips, probe, on_result, max_in_flight))
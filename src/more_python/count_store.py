@@ -0,0 +1,168 @@
+# more_python/count_store.py
+
+# Every page count reading ever taken, one row per printer per run, in a SQLite file
+# (output/page_counts.sqlite3). The totals_YYYY_MM.csv files are made from this with
+# export_wide_csv(), so a printer showing up or going away mid-month just adds or leaves a
+# blank column instead of shifting everything after it.
+#
+#   store = CountStore(path)
+#   store.add(month, reading)        # a PrinterReading, buffered
+#   store.flush()                    # one transaction for the whole batch
+#   store.history(serial)            # [PrinterReading, ...]
+#   store.export_wide_csv(month, csv_path)
+
+import csv
+import itertools
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+from more_python.printer_reading import PrinterReading, WideCsvWriter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    serial TEXT NOT NULL,   -- '' if the printer never answered with one
+    ip TEXT NOT NULL,
+    model TEXT NOT NULL,
+    month TEXT NOT NULL,    -- YYYY-MM of the totals file the reading belongs to
+    ts TEXT NOT NULL,       -- YYYY-MM-DD HH:MM:SS, the same for every printer in a run
+    bw INTEGER,             -- NULL = no answer / no count
+    color INTEGER
+);
+CREATE INDEX IF NOT EXISTS readings_serial_ts ON readings (serial, ts);
+CREATE INDEX IF NOT EXISTS readings_month_ts ON readings (month, ts);
+CREATE INDEX IF NOT EXISTS readings_ip ON readings (ip, ts);
+"""
+
+COLUMNS = "serial, ip, model, ts, bw, color"
+
+
+def _reading(row):
+    serial, ip, model, ts, bw, color = row
+    return PrinterReading(ip, model, serial, bw, color, answered=bw is not None or color is not None, ts=ts)
+
+
+class CountStore:
+    # readonly: for readers like _web_api.py, opens an existing file without touching the journal mode or schema
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.pending = []
+        if readonly:
+            self.db = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent, a power cut can only lose the last run
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    # a PrinterReading with ts set. a printer that didn't answer has no serial, the last serial
+    # seen at that IP is used so it stays the same printer in the export
+    def add(self, month, reading):
+        serial = reading.serial or self.last_serial_at(reading.ip) or ""
+        self.pending.append((serial, reading.ip, reading.model, month, reading.ts, reading.bw, reading.color))
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO readings (serial, ip, model, month, ts, bw, color) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self.pending)
+        self.pending = []
+
+    def last_serial_at(self, ip):
+        row = self.db.execute(
+            "SELECT serial FROM readings WHERE ip = ? AND serial != '' ORDER BY ts DESC LIMIT 1", (ip,)).fetchone()
+        if row:
+            return row[0]
+        # not flushed yet
+        for serial, pending_ip, *_ in reversed(self.pending):
+            if pending_ip == ip and serial:
+                return serial
+        return None
+
+    def has_month(self, month):
+        return self.db.execute("SELECT 1 FROM readings WHERE month = ? LIMIT 1", (month,)).fetchone() is not None
+
+    def months(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT month FROM readings ORDER BY month")]
+
+    # [PrinterReading, ...] oldest first. start/end are "YYYY-MM-DD..." strings
+    def history(self, serial, start=None, end=None):
+        query = f"SELECT {COLUMNS} FROM readings WHERE serial = ?"
+        args = [serial]
+        if start:
+            query += " AND ts >= ?"
+            args.append(start)
+        if end:
+            query += " AND ts < ?"
+            args.append(end)
+        return [_reading(row) for row in self.db.execute(query + " ORDER BY ts", args)]
+
+    # PrinterReadings for a month by run, read from the cursor as they're used
+    def month_readings(self, month):
+        cursor = self.db.execute(f"SELECT {COLUMNS} FROM readings WHERE month = ? ORDER BY ts, rowid", (month,))
+        return (_reading(row) for row in cursor)
+
+    # {reading.key: PrinterReading} with each printer's last reading that had a count in the month.
+    # the key is the serial, or "ip:<ip>" for a printer without one
+    def latest_readings(self, month):
+        latest = {}
+        for row in self.db.execute(
+                f"SELECT {COLUMNS} FROM readings WHERE month = ? AND (bw IS NOT NULL OR color IS NOT NULL) "
+                "ORDER BY ts, rowid", (month,)):
+            reading = _reading(row)
+            latest[reading.key] = reading
+        return latest
+
+    # one reading per printer seen in the month, first-seen order, with its latest ip and model
+    def month_devices(self, month):
+        devices = {}
+        for serial, ip, model in self.db.execute(
+                "SELECT serial, ip, model FROM readings WHERE month = ? ORDER BY ts, rowid", (month,)):
+            reading = PrinterReading(ip, model, serial)
+            if reading.key in devices:
+                reading.model = model or devices[reading.key].model
+            devices[reading.key] = reading
+        return list(devices.values())
+
+    # The month's totals_YYYY_MM.csv, rewritten from the store one run at a time
+    def export_wide_csv(self, month, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', newline='') as file:
+            writer = WideCsvWriter(file, month, self.month_devices(month))
+            for ts, readings in itertools.groupby(self.month_readings(month), key=lambda reading: reading.ts):
+                writer.write_run(ts, readings)
+        os.replace(temp_path, path)
+
+    # Load a totals_YYYY_MM.csv written before the store existed, so the export doesn't drop it
+    def import_wide_csv(self, month, path):
+        with open(path, newline='') as file:
+            rows = list(csv.reader(file))
+        if len(rows) < 4:
+            return 0
+        header, models, serials = rows[0], rows[1], rows[2]
+        imported = 0
+        for row in rows[4:]:
+            if len(row) < 2 or not row[0]:
+                continue
+            ts = f"{row[0]} {row[1]}"
+            for column in range(2, len(header), 2):
+                if not header[column]:
+                    continue
+                reading = PrinterReading(
+                    header[column],
+                    models[column] if column < len(models) else "",
+                    serials[column].strip() if column < len(serials) else "",
+                    row[column] if column < len(row) else None,
+                    row[column + 1] if column + 1 < len(row) else None,
+                    ts=ts)
+                self.pending.append((reading.serial, reading.ip, reading.model, month, ts, reading.bw, reading.color))
+                imported += 1
+        self.flush()
+        return imported
@@ -0,0 +1,209 @@
+# more_python/counter.py
+
+# The page counter without the files: how _printer_counter.py reads one printer, and
+# collect_counts() to read a list of them from other code. Nothing here reads settings.yaml,
+# and pysnmp only gets imported once the first request goes out.
+#
+#   from more_python import collect_counts
+#   for reading in collect_counts(["10.1.2.15", "10.1.2.16"], community="public"):
+#       print(reading.ip, reading.model, reading.bw, reading.color)
+
+import os
+from datetime import datetime
+
+from more_python.is_color_printer import is_color_printer, color_toner_oids, known_color_capability, ColorCapabilityCache
+from more_python import snmp_client
+from more_python.async_sweep import sweep
+from more_python.finder import ping, find_responders
+from more_python.oid_resolver import OidResolver
+from more_python.oid_profiles import OidProfiles
+from more_python.printer_mib import read_printer_mib
+from more_python.printer_reading import PrinterReading
+from more_python import metrics
+
+SERIAL_OIDS = [
+    "1.3.6.1.2.1.43.5.1.1.17.1"
+]
+MODEL_OID = "1.3.6.1.2.1.25.3.2.1.3.1"  # hrDeviceDescr of the first device
+
+
+def sanitize_output(input_str):
+    truncated = input_str[:64]
+    sanitized = ''.join(e for e in truncated if e.isalnum() or e.isspace())
+    return sanitized
+
+
+# a page counter is a plain number, anything else means the OID isn't the right one
+def is_valid_count(value):
+    return value is not None and value.strip().isdigit()
+
+
+# Reads printers one at a time with collect(ip), safe to call from many threads at once.
+# cache_directory: where oid_profiles.json and color_capability.json live between runs,
+# None keeps them in memory only
+# responders: the set of IPs that answered discovery, None = ping each one first
+# port: None = snmp_client.SNMP_PORT
+class Counter:
+    def __init__(self, community='public', cache_directory=None, oid_tables_file=None,
+                 bulk_walk_counts=False, unknown_models_log=None, responders=None, port=None):
+        self.community = community
+        self.port = port
+        self.bulk_walk_counts = bulk_walk_counts  # read the standard Printer-MIB tables before the vendor OIDs
+        self.responders = responders
+        self.timestamp = None  # what collect() puts in reading.ts
+
+        # b/w and color OIDs per model/vendor live in more_python/printer_oids.yaml
+        self.oid_resolver = OidResolver.from_file(oid_tables_file) if oid_tables_file else OidResolver.from_file()
+
+        # which of those OIDs worked for each printer last time
+        self.oid_profiles = OidProfiles(os.path.join(cache_directory, "oid_profiles.json") if cache_directory else None)
+
+        # color or b/w for printers that aren't in is_color_printer_dict, learned once from the toner levels
+        self.color_capability = ColorCapabilityCache(
+            os.path.join(cache_directory, "color_capability.json") if cache_directory else None,
+            unknown_models_log=unknown_models_log)
+
+    def save(self):
+        self.oid_profiles.save()
+        self.color_capability.save()
+
+    def is_alive(self, ip):
+        if self.responders is not None:
+            return ip in self.responders
+        return ping(ip)
+
+    # one printer, returns a PrinterReading
+    def collect(self, ip):
+        with metrics.timed("collect") as labels:
+            reading = self._collect(ip)
+            labels["outcome"] = "read" if reading.answered else "no response"
+        reading.ts = self.timestamp
+        return reading
+
+    def _collect(self, ip):
+        if not self.is_alive(ip):
+            return PrinterReading.no_response(ip)
+
+        # Get printer model and serial in one request
+        metrics.clear_context()
+        metrics.context(phase="model")
+        info = snmp_client.get_many(ip, [MODEL_OID] + SERIAL_OIDS, self.community, mp_model=1, port=self.port)
+        model = info[MODEL_OID] or ""
+
+        # Query serial number
+        serial = snmp_client.first_value(info, SERIAL_OIDS)
+        serial = sanitize_output(serial) if serial is not None else ""
+
+        # Get printer counts
+        metrics.context(phase="counts", vendor=metrics.vendor_of(model))
+        count_bw, count_color = self.get_printer_counts(ip, model, serial)
+        return PrinterReading(ip, model, serial, count_bw, count_color)
+
+    def get_printer_counts(self, ip, model, serial=""):
+        community, port = self.community, self.port
+        oid_resolver, oid_profiles, color_capability = self.oid_resolver, self.oid_profiles, self.color_capability
+
+        # the Printer-MIB total only stands in for the b/w count of a printer that has nothing better:
+        # no OID remembered from an earlier run and no known:/vendor entry in printer_oids.yaml.
+        # anything else keeps reading the same OID it always did, so the count doesn't jump mid-month
+        mib_total_usable = (not oid_profiles.winning(serial, model, 'bw')
+                            and not oid_resolver.has_entry('bw', model))
+        known = known_color_capability(model, serial, color_capability)
+
+        # with bulk_walk_counts the standard Printer-MIB tables are read first, one GETBULK,
+        # unless neither the total nor the colorants would be used
+        mib_total = mib_color = None
+        if self.bulk_walk_counts and (mib_total_usable or known is None):
+            mib = read_printer_mib(ip, community, port)
+            metrics.inc("printer_mib", outcome="found" if mib else "absent")
+            if mib is not None:
+                mib_total, mib_color = mib
+
+        # color or b/w without asking for the toner levels, if the table, the cache or the Printer-MIB knows
+        is_color = None
+        if known is not None or mib_color is not None:
+            with metrics.timed("color_probe", source="known" if known is not None else "printer-mib") as labels:
+                is_color = is_color_printer(ip, model, community, None, serial, color_capability, mib_color, port)
+                labels["outcome"] = "color" if is_color else "b/w"
+
+            # the Printer-MIB only has a lifetime total, for a b/w printer that's the b/w count
+            if not is_color and mib_total is not None and mib_total_usable:
+                metrics.inc("counts_source", source="printer-mib")
+                return mib_total, ""
+        if self.bulk_walk_counts:
+            metrics.inc("counts_source", source="vendor oids")
+
+        candidates = {
+            'bw': oid_resolver.resolve('bw', model),
+            'color': oid_resolver.resolve('color', model),
+        }
+
+        # if a previous run found which OID works for this printer, only ask for that one
+        asked = {}
+        for kind, oids in candidates.items():
+            winner = oid_profiles.winning(serial, model, kind)
+            asked[kind] = [winner] if winner in oids else oids
+
+        # one request for the OIDs (and the toner levels, if nobody knows yet whether it's a color printer),
+        # then take the first one that answered in each list, same order as before
+        oids = asked['bw'] + (asked['color'] if is_color is not False else [])
+        if is_color is None:
+            oids += color_toner_oids
+        values = snmp_client.get_many(ip, oids, community, mp_model=1, port=port)
+        if is_color is None:
+            with metrics.timed("color_probe", source="toner") as labels:
+                is_color = is_color_printer(ip, model, community, values, serial, color_capability,
+                                            port=port)  # Ensure model is passed
+                labels["outcome"] = "color" if is_color else "b/w"
+
+        counts = {}
+        for kind in ('bw', 'color') if is_color else ('bw',):
+            oids = asked[kind]
+            if oids is not candidates[kind] and not is_valid_count(values.get(oids[0])):
+                # the remembered OID stopped answering, forget it and ask for the whole list
+                oid_profiles.forget(serial, model, kind)
+                metrics.inc("oid_profile", kind=kind, outcome="stale")
+                oids = candidates[kind]
+                more = snmp_client.get_many(ip, oids, community, mp_model=1, port=port)
+                # keep .timed_out right: what answered now didn't time out, what timed out now did
+                values.update(more)
+                values.timed_out = (values.timed_out - more.keys()) | more.timed_out
+
+            # the first OID with a real count is both the one reported and the one remembered,
+            # if none has one, whatever answered first is reported like before and nothing is remembered
+            chosen = next((oid for oid in oids if is_valid_count(values.get(oid))), None)
+            if chosen is None:
+                counts[kind] = snmp_client.first_value(values, oids)
+            else:
+                counts[kind] = values[chosen]
+                oid_profiles.remember(serial, model, kind, chosen)
+
+        bw_count = counts['bw']
+
+        color_count = ""
+        if is_color:
+            color_count = counts['color']
+
+        return bw_count if bw_count is not None else "", color_count if color_count is not None else ""
+
+
+# Read the page counters of every IP, returns [PrinterReading, ...] in the order of ips.
+# workers: how many printers to read at once. host_discovery "snmp" checks which ones are up with
+# one UDP pass first, "ping" pings each one
+def collect_counts(ips, community='public', workers=16, host_discovery='snmp', port=None,
+                   cache_directory=None, bulk_walk_counts=False, oid_tables_file=None,
+                   discovery_timeout=1, discovery_retries=1):
+    if isinstance(ips, str):
+        ips = [ips]
+    ips = list(ips)
+
+    responders = None
+    if host_discovery == 'snmp':
+        responders = find_responders(ips, community, port, discovery_timeout, discovery_retries)
+
+    counter = Counter(community, cache_directory, oid_tables_file, bulk_walk_counts, responders=responders, port=port)
+    counter.timestamp = f"{datetime.now():%Y-%m-%d %H:%M:%S}"
+    readings = []
+    sweep(ips, counter.collect, lambda ip, reading: readings.append(reading), workers)
+    counter.save()
+    return readings
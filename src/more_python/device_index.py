@@ -0,0 +1,64 @@
+# more_python/device_index.py
+
+import csv
+import os
+
+from more_python import metrics
+
+HEADER = "ip,model,serial,hostname"
+
+
+# The foundprinters_YYYY-MM.csv loaded once into memory.
+# Lookups by IP or serial are dict hits instead of re-reading the file for every printer,
+# new rows are kept in a buffer and appended to the file flush_every rows at a time.
+class DeviceIndex:
+    def __init__(self, path, flush_every=50):
+        self.path = path
+        self.flush_every = flush_every
+        self.by_ip = {}  # ip -> [ip, model, serial, hostname]
+        self.by_serial = {}  # serial -> ip
+        self.pending = []  # rows not written yet
+
+        if os.path.isfile(path):
+            with open(path, newline='') as file:
+                for row in list(csv.reader(file))[1:]:
+                    if row:
+                        self._index(row)
+        else:
+            # Initialize CSV file with headers if it doesn't exist
+            with open(path, 'w') as file:
+                file.write(HEADER + "\n")
+
+    def _index(self, row):
+        ip = row[0]
+        serial = row[2] if len(row) > 2 else ""
+        self.by_ip[ip] = row
+        if serial:
+            self.by_serial[serial] = ip
+
+    def __contains__(self, ip):
+        return ip in self.by_ip
+
+    def __len__(self):
+        return len(self.by_ip)
+
+    # IP the serial was last recorded at, or None
+    def ip_for_serial(self, serial):
+        return self.by_serial.get(serial)
+
+    def add(self, ip, model, serial, hostname):
+        row = [ip, model, serial, hostname]
+        self._index(row)
+        self.pending.append(row)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # same plain "a,b,c,d" lines the finder always wrote, the values already have commas stripped
+        with metrics.timed("csv_write", file="foundprinters"):
+            with open(self.path, 'a') as file:
+                file.writelines(",".join(row) + "\n" for row in self.pending)
+        metrics.inc("csv_rows", len(self.pending), file="foundprinters")
+        self.pending = []
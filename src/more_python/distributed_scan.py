@@ -0,0 +1,285 @@
+# more_python/distributed_scan.py
+
+# One finder run split over several machines (or several processes on one machine).
+#
+# The coordinator (_find_printers.py --coordinator) cuts the subnets in settings.yaml into work
+# units of unit_size addresses and hands them out to workers (_find_printers.py --worker HOST:PORT)
+# over TCP. Every message is one line of JSON, one request and one answer per connection:
+#
+#   {"op": "get", "worker": name}                  -> {"op": "unit", "unit": {...}, "lease": seconds}
+#                                                     {"op": "wait", "seconds": n}  everything's handed out
+#                                                     {"op": "done"}                nothing left, exit
+#   {"op": "renew", "worker": name, "unit": id}    -> {"op": "ok"} or {"op": "lost"} (it went to someone else)
+#   {"op": "result", "worker": name, "unit": id, "printers": [...]}
+#                                                  -> {"op": "ok"}
+#
+# A unit is leased for lease_timeout seconds and the worker renews it while it scans. A worker that
+# dies or hangs stops renewing, and the unit goes back in the queue for the next one that asks.
+# If the first worker turns up with a result after all, whichever result comes first is used.
+# Results are handed to on_result in unit order, so the foundprinters CSV comes out the same as a
+# single-machine run no matter which worker finishes first.
+#
+# There is no authentication, so only run the coordinator on a network you trust.
+
+import ipaddress
+import json
+import socket
+import socketserver
+import threading
+import time
+
+from more_python import finder
+from more_python import metrics
+
+WAIT_SECONDS = 2  # how long a worker waits when every unit is handed out but not all are back
+EMIT_ATTEMPTS = 3  # on_result failures before a unit's result is thrown away and the unit scanned again
+UNIT_SCANS = 3  # results thrown away for one unit before it's given up on and skipped
+
+
+# the subnets as address ranges of at most unit_size hosts:
+#   [{"id": 0, "subnet": "10.1.0.0/23", "first": "10.1.0.1", "last": "10.1.0.255"}, ...]
+def shard(subnets, unit_size=256):
+    units = []
+    for subnet in subnets:
+        network = ipaddress.IPv4Network(subnet, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        if network.num_addresses > 2:
+            first, last = first + 1, last - 1  # same hosts as finder.generate_ips_in_subnet
+        for start in range(first, last + 1, unit_size):
+            units.append({
+                "id": len(units),
+                "subnet": str(network),
+                "first": str(ipaddress.IPv4Address(start)),
+                "last": str(ipaddress.IPv4Address(min(start + unit_size - 1, last))),
+            })
+    return units
+
+
+def unit_ips(unit):
+    first, last = int(ipaddress.IPv4Address(unit["first"])), int(ipaddress.IPv4Address(unit["last"]))
+    return [str(ipaddress.IPv4Address(address)) for address in range(first, last + 1)]
+
+
+# ---- coordinator ----
+
+class Coordinator:
+    # on_result(unit, printers) is called once per unit, in unit order
+    def __init__(self, units, on_result, lease_timeout=300):
+        self.units = {unit["id"]: unit for unit in units}
+        self.on_result = on_result
+        self.lease_timeout = lease_timeout
+        self.lock = threading.Lock()
+        self.queue = [unit["id"] for unit in units]  # not handed out yet, or handed back
+        self.leases = {}  # unit id -> (worker, deadline)
+        self.results = {}  # unit id -> printers, waiting for earlier units
+        self.next_to_emit = 0
+        self.emit_failures = {}  # unit id -> times on_result raised for it
+        self.rejections = {}  # unit id -> results thrown away for it, kept over rescans
+        self.failed = []  # unit ids given up on, their printers never reached on_result
+        self.finished = threading.Event()
+        if not units:
+            self.finished.set()
+
+    def handle(self, message):
+        op = message.get("op")
+        with self.lock:
+            self._requeue_expired()
+            if op == "get":
+                return self._get(message.get("worker", "?"))
+            if op == "renew":
+                return self._renew(message.get("worker", "?"), message.get("unit"))
+            if op == "result":
+                return self._result(message.get("worker", "?"), message.get("unit"), message.get("printers") or [])
+        return {"op": "error", "error": f"unknown op {op!r}"}
+
+    def _get(self, worker):
+        if self.finished.is_set():
+            return {"op": "done"}
+        if not self.queue:
+            # all handed out, the worker waits in case one of them comes back
+            return {"op": "wait", "seconds": WAIT_SECONDS}
+        unit_id = self.queue.pop(0)
+        self.leases[unit_id] = (worker, time.monotonic() + self.lease_timeout)
+        metrics.inc("scan_units", outcome="leased")
+        return {"op": "unit", "unit": self.units[unit_id], "lease": self.lease_timeout}
+
+    def _renew(self, worker, unit_id):
+        lease = self.leases.get(unit_id)
+        if lease is None or lease[0] != worker:
+            return {"op": "lost"}
+        self.leases[unit_id] = (worker, time.monotonic() + self.lease_timeout)
+        return {"op": "ok"}
+
+    def _result(self, worker, unit_id, printers):
+        if unit_id not in self.units:
+            return {"op": "error", "error": f"unknown unit {unit_id!r}"}
+        if unit_id in self.results or unit_id < self.next_to_emit:
+            metrics.inc("scan_units", outcome="duplicate")
+            return {"op": "ok"}  # someone else already sent it
+        self.leases.pop(unit_id, None)
+        if unit_id in self.queue:
+            self.queue.remove(unit_id)  # came back after the lease ran out, still good
+        self.results[unit_id] = printers
+        metrics.inc("scan_units", outcome="done")
+        self._emit()
+        return {"op": "ok"}
+
+    # hand the results that are next in line to on_result. a result is only dropped once on_result
+    # went through, if it raises the result stays and serve() tries again. after EMIT_ATTEMPTS the
+    # unit is scanned again, and after UNIT_SCANS of those it's skipped so the rest can finish
+    def _emit(self):
+        while self.next_to_emit in self.results:
+            unit_id = self.next_to_emit
+            try:
+                self.on_result(self.units[unit_id], self.results[unit_id])
+            except Exception as error:
+                failures = self.emit_failures[unit_id] = self.emit_failures.get(unit_id, 0) + 1
+                print(f"unit {unit_id}: writing the result failed ({error!r}), attempt {failures} of {EMIT_ATTEMPTS}")
+                if failures < EMIT_ATTEMPTS:
+                    return
+                del self.results[unit_id]
+                self.emit_failures.pop(unit_id)
+                rejections = self.rejections[unit_id] = self.rejections.get(unit_id, 0) + 1
+                if rejections < UNIT_SCANS:
+                    # something's wrong with this result, have it scanned again
+                    self.queue.insert(0, unit_id)
+                    metrics.inc("scan_units", outcome="rejected")
+                    return
+                unit = self.units[unit_id]
+                print(f"unit {unit_id} ({unit['first']} - {unit['last']}): giving up after {rejections} scans "
+                      f"that couldn't be written, its printers are missing from this run")
+                self.failed.append(unit_id)
+                self.leases.pop(unit_id, None)  # a copy still out there is dropped as a duplicate
+                if unit_id in self.queue:
+                    self.queue.remove(unit_id)
+                metrics.inc("scan_units", outcome="failed")
+                self.next_to_emit += 1
+                continue
+            del self.results[unit_id]
+            self.emit_failures.pop(unit_id, None)
+            self.next_to_emit += 1
+        if self.next_to_emit >= len(self.units):
+            self.finished.set()
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        for unit_id, (worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[unit_id]
+                self.queue.insert(0, unit_id)
+                metrics.inc("scan_units", outcome="requeued")
+                print(f"unit {unit_id} ({self.units[unit_id]['first']} - {self.units[unit_id]['last']}) "
+                      f"timed out on {worker}, handing it out again")
+
+    # serve until every unit has a result. returns the server's address (host, port) through ready
+    def serve(self, host='127.0.0.1', port=0, ready=None):
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    message = json.loads(self.rfile.readline())
+                    answer = coordinator.handle(message)
+                except Exception as error:
+                    # a worker always gets an answer, even if this side broke
+                    answer = {"op": "error", "error": f"{type(error).__name__}: {error}"}
+                self.wfile.write(json.dumps(answer).encode() + b"\n")
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        with Server((host, port), Handler) as server:
+            if ready:
+                ready(server.server_address)
+            thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.2}, daemon=True)
+            thread.start()
+            try:
+                while not self.finished.wait(1):
+                    with self.lock:
+                        self._requeue_expired()
+                        self._emit()  # retries a result on_result failed on
+                # give waiting workers a moment to ask again and hear "done"
+                time.sleep(WAIT_SECONDS + 1)
+            finally:
+                server.shutdown()
+
+
+# ---- worker ----
+
+def request(address, message, timeout=30):
+    host, port = address
+    with socket.create_connection((host, int(port)), timeout=timeout) as connection:
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        answer = connection.makefile('rb').readline()
+    try:
+        return json.loads(answer)
+    except ValueError:
+        # the connection closed without a (whole) answer, same as not getting through
+        raise ConnectionError(f"no answer from {host}:{port}")
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+# ask for units until the coordinator says done. scan_settings are finder.scan()'s keyword arguments
+def run_worker(address, name, scan_settings, connect_retries=10):
+    scanned = 0
+    failures = 0
+    while True:
+        try:
+            answer = request(address, {"op": "get", "worker": name})
+            failures = 0
+        except OSError as error:
+            # the coordinator finished and went away, or isn't up yet
+            failures += 1
+            if failures > connect_retries:
+                print(f"worker {name}: can't reach the coordinator at {address[0]}:{address[1]} ({error}), stopping")
+                return scanned
+            time.sleep(1)
+            continue
+
+        if answer.get("op") == "done":
+            return scanned
+        if answer.get("op") == "wait":
+            time.sleep(answer.get("seconds", 1))
+            continue
+        if answer.get("op") != "unit":
+            print(f"worker {name}: unexpected answer {answer}")
+            time.sleep(1)
+            continue
+
+        unit = answer["unit"]
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(target=_renew_lease, args=(address, name, unit["id"], answer["lease"], stop_renewing),
+                                   daemon=True)
+        renewer.start()
+        try:
+            with metrics.timed("scan_unit"):
+                printers = finder.scan(unit_ips(unit), **scan_settings)
+        finally:
+            stop_renewing.set()
+        print(f"worker {name}: {unit['first']} - {unit['last']}, {len(printers)} printers")
+        _send_result(address, name, unit["id"], printers)
+        scanned += 1
+
+
+def _renew_lease(address, name, unit_id, lease, stop):
+    while not stop.wait(max(1, lease / 3)):
+        try:
+            if request(address, {"op": "renew", "worker": name, "unit": unit_id}).get("op") == "lost":
+                return
+        except OSError:
+            pass  # try again next time, the lease is long enough for a missed one
+
+
+def _send_result(address, name, unit_id, printers, attempts=5):
+    for attempt in range(attempts):
+        try:
+            request(address, {"op": "result", "worker": name, "unit": unit_id, "printers": printers})
+            return
+        except OSError:
+            time.sleep(1 + attempt)
+    print(f"worker {name}: couldn't send the result for unit {unit_id}, it'll be scanned again")
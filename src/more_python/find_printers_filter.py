@@ -1,4 +1,4 @@
-from pysnmp.hlapi import *
+from more_python import snmp_client
 
 
 
@@ -25,26 +25,22 @@ printer_test_oids = [
     "1.3.6.1.2.1.25.3.2.1.3.1"  # Example OID for printer model
 ]
 
-def is_printer(ip, snmpv1_community):
+# values: {oid: value} already fetched with snmp_client.get_many(), if None the test OIDs are fetched here
+def is_printer(ip, snmpv1_community, values=None, port=None):
     model = None
     snmpv1_community = snmpv1_community
+
+    if values is None:
+        values = snmp_client.get_many(ip, printer_test_oids, snmpv1_community, port=port)
     
     # Check the OIDs to detect the model
     for oid in printer_test_oids:
-        errorIndication, errorStatus, errorIndex, varBinds = next(
-            getCmd(SnmpEngine(),
-                   CommunityData(snmpv1_community, mpModel=0),
-                   UdpTransportTarget((ip, 161)),
-                   ContextData(),
-                   ObjectType(ObjectIdentity(oid)))
-        )
+        value = values.get(oid)
 
-        if not errorIndication and not errorStatus:
-            for varBind in varBinds:
-                if str(varBind[1]):
-                    if oid.endswith("1.3.6.1.2.1.25.3.2.1.3.1"):  # Assuming this OID represents the model
-                        model = str(varBind[1])
-                        break
+        if value:
+            if oid.endswith("1.3.6.1.2.1.25.3.2.1.3.1"):  # Assuming this OID represents the model
+                model = value
+                break
 
     # Ensure model has a value before using it
     if model:
@@ -55,19 +51,9 @@ def is_printer(ip, snmpv1_community):
 
     # If model is not in ignore list or not detected, proceed with OID checks
     for oid in printer_test_oids:
-        errorIndication, errorStatus, errorIndex, varBinds = next(
-            getCmd(SnmpEngine(),
-                   CommunityData(snmpv1_community, mpModel=0),
-                   UdpTransportTarget((ip, 161)),
-                   ContextData(),
-                   ObjectType(ObjectIdentity(oid)))
-        )
-
-        if not errorIndication and not errorStatus:
-            for varBind in varBinds:
-                if str(varBind[1]):
-                    returnString = "is printer"
-                    return (True, returnString)  # OID check passed, it is a printer
+        if values.get(oid):
+            returnString = "is printer"
+            return (True, returnString)  # OID check passed, it is a printer
 
     returnString = "not a printer"
     return (False, returnString)  # Defaulting to not a printer if no model or OID check passed
@@ -0,0 +1,146 @@
+# more_python/finder.py
+
+# The printer finder without the files: what _find_printers.py does to one address, and
+# discover() to do it to whole subnets from other code. Nothing here reads settings.yaml or
+# writes anything, and pysnmp only gets imported once the first request goes out.
+#
+#   from more_python import discover
+#   for printer in discover(["10.1.2.0/24"], community="public"):
+#       print(printer["ip"], printer["model"], printer["serial"])
+
+import ipaddress
+import subprocess
+
+from more_python.find_printers_filter import is_printer, printer_test_oids
+from more_python.async_sweep import sweep
+from more_python import snmp_client
+from more_python import udp_discovery
+from more_python import metrics
+
+# Define OIDs for different printer data
+SERIAL_OIDS = [
+    ".1.3.6.1.2.1.43.5.1.1.17.1",  # General printer serial number OID
+    ".1.3.6.1.4.1.2385.1.1.5.1.1.1",  # Konica Minolta specific OID (example)
+    ".1.3.6.1.4.1.1347.41.1.1.1.1.4.0"  # Ecosys specific OID (example)
+]
+MODEL_OID = ".1.3.6.1.2.1.1.1.0"  # OID for the printer model
+HOSTNAME_OID = ".1.3.6.1.2.1.1.5.0"  # OID for the printer hostname
+# everything probe_ip asks a device for, sent together in one request
+DISCOVERY_OIDS = SERIAL_OIDS + [MODEL_OID, HOSTNAME_OID] + printer_test_oids
+
+
+# Function to generate IPs in a subnet
+def generate_ips_in_subnet(subnet):
+    network = ipaddress.IPv4Network(subnet, strict=False)
+    for ip in network.hosts():
+        yield str(ip)
+
+
+# Skip if IP is x.x.x.1 or x.x.x.255
+def is_skipped_ip(current_ip):
+    return current_ip.endswith('.1') or current_ip.endswith('.255')
+
+
+def ping(ip):
+    with metrics.timed("ping") as labels:
+        response = subprocess.run(['ping', '-c', '1', '-W', '1', ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        labels["outcome"] = "alive" if response.returncode == 0 else "dead"
+    return response.returncode == 0
+
+
+# one fast UDP pass over the IPs, returns the set that answered SNMP
+def find_responders(ips, community='public', port=None, timeout=1, retries=1):
+    with metrics.timed("discovery"):
+        return udp_discovery.discover(ips, community, port=port or snmp_client.SNMP_PORT,
+                                      timeout=timeout, retries=retries)
+
+
+# Function to get data from the printer using SNMP.
+# values is what snmp_client.get_many() already fetched for DISCOVERY_OIDS, if None they're fetched here
+# port None = snmp_client.SNMP_PORT
+def get_printer_data(ip, community='public', values=None, port=None):
+    if values is None:
+        values = snmp_client.get_many(ip, DISCOVERY_OIDS, community, port=port)
+
+    # first serial OID that answers wins, same order as SERIAL_OIDS
+    serial = snmp_client.first_value(values, SERIAL_OIDS) or ""
+    model = values.get(MODEL_OID) or ""
+    hostname = values.get(HOSTNAME_OID) or ""
+
+    serial = serial.replace(",", " ")
+    model = model.replace(",", " ")
+    hostname = hostname.replace(",", " ")
+
+    max_length = 40
+    return serial, model[:max_length], hostname
+
+
+# Function to probe an IP address. This is the slow part (ping + snmp) and doesn't touch any files,
+# so the async sweep can run a lot of these at once.
+# responders: IPs that answered the UDP discovery sweep. if given, ping is skipped and anything
+# not in it counts as no response
+# returns ("skipped",), ("no response",) or ("polled", serial, model, hostname, is_printer_flag, returnString)
+def probe_ip(current_ip, community='public', responders=None, port=None):
+    with metrics.timed("probe") as labels:
+        result = _probe_ip(current_ip, community, responders, port)
+        labels["outcome"] = result[0] if result[0] != "polled" else "printer" if result[4] else "not a printer"
+    return result
+
+
+def _probe_ip(current_ip, community, responders, port):
+    if is_skipped_ip(current_ip):
+        return ("skipped",)
+
+    if responders is not None:
+        if current_ip not in responders:
+            return ("no response",)
+    elif not ping(current_ip):
+        return ("no response",)
+
+    # one request for everything discovery needs instead of one per OID
+    metrics.clear_context()
+    metrics.context(phase="probe")
+    values = snmp_client.get_many(current_ip, DISCOVERY_OIDS, community, port=port)
+    serial, model, hostname = get_printer_data(current_ip, community, values, port)
+
+    with metrics.timed("classify", vendor=metrics.vendor_of(model)) as labels:
+        is_printer_flag, returnString = is_printer(current_ip, community, values, port)
+        labels["outcome"] = "printer" if is_printer_flag else "not a printer"
+    return ("polled", serial, model, hostname, is_printer_flag, returnString)
+
+
+# Probe every address in the subnets (CIDR strings) and return the printers found, in address order:
+#   [{"ip": ..., "model": ..., "serial": ..., "hostname": ..., "type": ...}, ...]
+# host_discovery "snmp" finds the live hosts with one UDP pass, "ping" pings each one
+def discover(subnets, community='public', max_in_flight=32, host_discovery='snmp', port=None,
+             discovery_timeout=1, discovery_retries=1):
+    if isinstance(subnets, str):
+        subnets = [subnets]
+    ips = [ip for subnet in subnets for ip in generate_ips_in_subnet(subnet)]
+    return scan(ips, community, max_in_flight, host_discovery, port, discovery_timeout, discovery_retries)
+
+
+# the same for a list of IPs
+def scan(ips, community='public', max_in_flight=32, host_discovery='snmp', port=None,
+         discovery_timeout=1, discovery_retries=1):
+    printers = []
+
+    def record(ip, result):
+        if result[0] == "polled" and result[4]:
+            _, serial, model, hostname, _, returnString = result
+            printers.append({"ip": ip, "model": model, "serial": serial, "hostname": hostname, "type": returnString})
+
+    probe_all(ips, record, community, max_in_flight, host_discovery, port, discovery_timeout, discovery_retries)
+    return printers
+
+
+# probe_ip() for every IP, host discovery first. on_result(ip, result) gets each one, in the order of ips
+def probe_all(ips, on_result, community='public', max_in_flight=32, host_discovery='snmp', port=None,
+              discovery_timeout=1, discovery_retries=1):
+    ips = list(ips)
+    responders = None
+    if host_discovery == 'snmp':
+        responders = find_responders([ip for ip in ips if not is_skipped_ip(ip)], community,
+                                     port, discovery_timeout, discovery_retries)
+
+    sweep(ips, lambda ip: probe_ip(ip, community, responders, port), on_result, max_in_flight)
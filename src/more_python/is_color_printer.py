@@ -1,61 +1,114 @@
 # more_python/printer_type.py
 
-from pysnmp.hlapi import *
+from datetime import datetime
+
+from more_python import snmp_client
+from more_python.json_cache import JsonCache
 
 def snmp_get(snmpv1_community, ip, oid):
-    errorIndication, errorStatus, errorIndex, varBinds = next(
-        getCmd(SnmpEngine(),
-               CommunityData(snmpv1_community, mpModel=0),
-               UdpTransportTarget((ip, 161)),
-               ContextData(),
-               ObjectType(ObjectIdentity(oid)))
-    )
-    if errorIndication or errorStatus:
+    return snmp_client.get(ip, oid, snmpv1_community)
+
+# OIDs for checking toner status
+toner_oids = {
+    'black': '1.3.6.1.2.1.43.11.1.1.9.1.1',
+    'cyan': '1.3.6.1.2.1.43.11.1.1.9.1.2',
+    'magenta': '1.3.6.1.2.1.43.11.1.1.9.1.3',
+    'yellow': '1.3.6.1.2.1.43.11.1.1.9.1.4'
+}
+color_toner_oids = [toner_oids[color] for color in ['cyan', 'magenta', 'yellow']]
+
+# 1 = color, 0 = B/W
+is_color_printer_dict = { 
+    'ECOSYS M3860idn': '0',
+    'ECOSYS P3260dn': '0',
+    'ECOSYS M6235cidn': '1',
+    'ECOSYS P3155dn': '0',
+    'ECOSYS P3145dn': '0',
+    'ECOSYS PA4500x': '0',
+    'ECOSYS P2135dn': '0',
+    'ECOSYS P2235dw': '0',
+    'ECOSYS M3655idn': '0',
+    'Dell B2360dn': '0',
+    'KONICA MINOLTA bizhub 360i': '0',
+    'KONICA MINOLTA bizhub C558': '1',
+    'HP LaserJet MFP M130nw': '0',
+    'HP Color LaserJet Pro M454dn': '1',
+    'Source Technologies ST9820': '0',
+    'KONICA MINOLTA bizhub 450i': '0',
+    'Source Technologies ST9820': '0',
+}
+
+
+# Color capability learned from the toner check (or the Printer-MIB colorants), kept between runs so each printer only
+# gets probed once: {"serial:RP61703537": false, "model:ECOSYS P3260dn": false}
+# the serial: entry is always brought up to date, the model: entry is the first answer seen for that model and
+# only stands in for printers of that model that haven't been seen yet.
+# unknown_models_log gets a line for every model learned this way, so it can be looked at
+# and added to is_color_printer_dict
+class ColorCapabilityCache(JsonCache):
+    def __init__(self, path, unknown_models_log=None):
+        super().__init__(path)
+        self.unknown_models_log = unknown_models_log
+
+    def lookup(self, model, serial=""):
+        for key in (f"serial:{serial}" if serial else None, f"model:{model}" if model else None):
+            if key and self.get(key) is not None:
+                return self.get(key)
         return None
-    else:
-        for varBind in varBinds:
-            return str(varBind[1])
-    return None
-def is_color_printer(ip, model, snmpv1_community):
-    # OIDs for checking toner status
-    toner_oids = {
-        'black': '1.3.6.1.2.1.43.11.1.1.9.1.1',
-        'cyan': '1.3.6.1.2.1.43.11.1.1.9.1.2',
-        'magenta': '1.3.6.1.2.1.43.11.1.1.9.1.3',
-        'yellow': '1.3.6.1.2.1.43.11.1.1.9.1.4'
-    }
-
-    # 1 = color, 0 = B/W
-    is_color_printer_dict = { 
-        'ECOSYS M3860idn': '0',
-        'ECOSYS P3260dn': '0',
-        'ECOSYS M6235cidn': '1',
-        'ECOSYS P3155dn': '0',
-        'ECOSYS P3145dn': '0',
-        'ECOSYS PA4500x': '0',
-        'ECOSYS P2135dn': '0',
-        'ECOSYS P2235dw': '0',
-        'ECOSYS M3655idn': '0',
-        'Dell B2360dn': '0',
-        'KONICA MINOLTA bizhub 360i': '0',
-        'KONICA MINOLTA bizhub C558': '1',
-        'HP LaserJet MFP M130nw': '0',
-        'HP Color LaserJet Pro M454dn': '1',
-        'Source Technologies ST9820': '0',
-        'KONICA MINOLTA bizhub 450i': '0',
-        'Source Technologies ST9820': '0',
-    }
-#to do: if printer model isn't found on here, it needs to add the printer and it's I.P to the a new LOG for investiation
 
+    def learn(self, ip, model, serial, is_color, source="toner check"):
+        # checked and set under one lock, so two threads reading the same model log it once
+        with self.lock:
+            if serial and self.data.get(f"serial:{serial}") != is_color:
+                self.data[f"serial:{serial}"] = is_color
+                self.dirty = True
+            if not model or f"model:{model}" in self.data:
+                return
+            self.data[f"model:{model}"] = is_color
+            self.dirty = True
+            if self.unknown_models_log:
+                with open(self.unknown_models_log, 'a') as log:
+                    kind = "color" if is_color else "b/w"
+                    log.write(f"{datetime.now():%Y-%m-%d %H:%M} - {ip} - {model} - {serial} - looks {kind} ({source})\n")
+
+
+# True/False if the answer is known without asking the printer, None if the toner check is needed
+def known_color_capability(model, serial="", cache=None):
     # If model is recognized in the dictionary, use it to determine if it's a color printer
     if model in is_color_printer_dict:
         return is_color_printer_dict[model] == '1'
+    if cache is not None:
+        return cache.lookup(model, serial)
+    return None
+
+# values: {oid: value} already fetched with snmp_client.get_many(), lets the caller put the
+# toner OIDs in the same request as its own. if None they're fetched here (only when needed)
+# cache: a ColorCapabilityCache, what the toner check finds is written back to it
+# mib_color: True/False from the Printer-MIB colorant table (printer_mib.read_printer_mib), if the
+# counter already walked it. used instead of the toner check
+# port: None = snmp_client.SNMP_PORT
+def is_color_printer(ip, model, snmpv1_community, values=None, serial="", cache=None, mib_color=None, port=None):
+    known = known_color_capability(model, serial, cache)
+    if known is not None:
+        return known
+
+    if mib_color is not None:
+        if cache is not None:
+            cache.learn(ip, model, serial, mib_color, source="printer-mib colorants")
+        return mib_color
 
     # If the model is not recognized, fall back to checking toner OIDs
-    for color in ['cyan', 'magenta', 'yellow']:
-        result = snmp_get(snmpv1_community, ip, toner_oids[color])
+    if values is None or not any(oid in values for oid in color_toner_oids):
+        values = snmp_client.get_many(ip, color_toner_oids, snmpv1_community, port=port)
+    is_color = False  # It's a B/W printer if no color toner is present
+    for oid in color_toner_oids:
+        result = values.get(oid)
         if result is not None and result != 'noSuchInstance':
-            return True  # It's a color printer if any color toner is present
-
-    return False  # It's a B/W printer if no color toner is present
+            is_color = True  # It's a color printer if any color toner is present
+            break
 
+    # a timeout (or a host snmp_client gave up on) leaves every toner OID at None too. that's b/w for
+    # this run, but only a printer that actually answered gets remembered
+    if cache is not None and any(snmp_client.answered(values, oid) for oid in color_toner_oids):
+        cache.learn(ip, model, serial, is_color)
+    return is_color
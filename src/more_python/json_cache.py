@@ -0,0 +1,51 @@
+# more_python/json_cache.py
+
+import json
+import os
+import threading
+
+
+# A small dict that lives in a json file between runs.
+# Loaded once, changed in memory (safe to use from the counter's worker threads),
+# and written back with save() only if something changed. path None = memory only.
+class JsonCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.data = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as file:
+                    self.data = json.load(file)
+            except (OSError, ValueError):
+                # a broken cache only costs us the lookups it would have saved
+                self.data = {}
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            if self.data.get(key) != value:
+                self.data[key] = value
+                self.dirty = True
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.data:
+                del self.data[key]
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # write to a temp file first so a crash mid-write can't leave half a file
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(self.data, file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+            self.dirty = False
@@ -0,0 +1,148 @@
+# more_python/log_sink.py
+
+# The TodaysLog and log_YYYY-MM.txt files, kept open for the whole run and written from a
+# background thread. Opening and closing the file for every line cost a syscall pair per IP,
+# tens of thousands of them on a /16 sweep.
+#
+#   log = LogSink(path, rotate=True, max_bytes=10_000_000)      # append, rotate at 10 MB
+#   log = LogSink(path, rotate=True, **sink_settings(config))   # the same from settings.yaml
+#   tlog = LogSink(todays_path, truncate=True)                  # start empty, like the old open(path, 'w')
+#   tlog.write(f"{ip} - ?\n", ip=ip, event="no response")
+#   tlog.close()                                   # writes what's left
+#
+# write() only adds to a buffer. The thread writes it out once flush_bytes have piled up or
+# flush_seconds after the first line of a batch, whichever comes first, and at close().
+# Every line is also a record: the text plus the keyword arguments, with a timestamp. With
+# structured=True they go to a .jsonl file next to the log, one JSON object per line.
+# rotate=True: once the log is over max_bytes, it's renamed to .1 (.1 to .2 and so on, backups of
+# them kept) and a new one is started.
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+# the LogSink arguments from settings.yaml, the same for every log file.
+# log_max_bytes and log_backups only matter for sinks made with rotate=True
+def sink_settings(config):
+    return {
+        'flush_seconds': config.get('log_flush_seconds', 1.0),
+        'flush_bytes': config.get('log_flush_bytes', 64 * 1024),
+        'max_bytes': config.get('log_max_bytes', 10_000_000),
+        'backups': config.get('log_backups', 5),
+        'structured': config.get('structured_logs', False),
+    }
+
+
+class LogSink:
+    def __init__(self, path, truncate=False, flush_bytes=64 * 1024, flush_seconds=1.0,
+                 max_bytes=10_000_000, backups=5, structured=False, rotate=False):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes if rotate else None
+        self.backups = backups
+        self.structured_path = os.path.splitext(path)[0] + ".jsonl" if structured else None
+
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.buffer = []  # text waiting to be written
+        self.records = []  # the same as dicts, if structured
+        self.buffered_bytes = 0
+        self.first_buffered = None  # monotonic time of the oldest buffered line
+        self.closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'w' if truncate else 'a')
+        self.structured_file = open(self.structured_path, 'w' if truncate else 'a') if structured else None
+
+        self.thread = threading.Thread(target=self._run, name=f"log {os.path.basename(path)}", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, text, **fields):
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer.append(text)
+            self.buffered_bytes += len(text)
+            if self.structured_file:
+                self.records.append({"ts": datetime.now().isoformat(timespec='milliseconds'),
+                                     "text": text.rstrip("\n"), **fields})
+            if self.first_buffered is None:
+                self.first_buffered = time.monotonic()
+                self.wake.notify()
+            elif self.buffered_bytes >= self.flush_bytes:
+                self.wake.notify()
+
+    # write everything buffered now, from the calling thread
+    def flush(self):
+        with self.lock:
+            self._write_buffer()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.wake.notify()
+        self.thread.join()
+        with self.lock:
+            self._write_buffer()
+            self.file.close()
+            if self.structured_file:
+                self.structured_file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        with self.lock:
+            while not self.closed:
+                if self.first_buffered is None:
+                    self.wake.wait()
+                    continue
+                due = self.first_buffered + self.flush_seconds - time.monotonic()
+                if due > 0 and self.buffered_bytes < self.flush_bytes:
+                    self.wake.wait(due)
+                    continue
+                self._write_buffer()
+
+    # called with the lock held
+    def _write_buffer(self):
+        if not self.buffer:
+            return
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        if self.structured_file:
+            self.structured_file.writelines(json.dumps(record) + "\n" for record in self.records)
+            self.structured_file.flush()
+        self.buffer, self.records = [], []
+        self.buffered_bytes = 0
+        self.first_buffered = None
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        paths = [self.path] + ([self.structured_path] if self.structured_file else [])
+        if self.structured_file:
+            self.structured_file.close()
+        for path in paths:
+            for number in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{path}.{number}"):
+                    os.replace(f"{path}.{number}", f"{path}.{number + 1}")
+            if self.backups > 0:
+                os.replace(path, f"{path}.1")
+            else:
+                os.remove(path)
+        self.file = open(self.path, 'a')
+        if self.structured_file:
+            self.structured_file = open(self.structured_path, 'a')
@@ -0,0 +1,230 @@
+# more_python/metrics.py
+
+# Counters and latency histograms for one run of a script, so a slow run shows where the time
+# went (ping, snmp timeouts, which OIDs, the color probe, writing files) instead of just the
+# start and finish lines in TodaysLog.
+#
+#   from more_python import metrics
+#   with metrics.timed("ping") as labels:
+#       ...
+#       labels["outcome"] = "dead"      # labels can be filled in before the block ends
+#   metrics.inc("snmp_oids", oid=oid, outcome="value")
+#   metrics.context(vendor="konica")    # labels that every snmp request on this thread gets
+#   metrics.save(year_output_dir, "FindPrinters")
+#
+# save() writes metrics_<name>.json (counts, sums, p50/p95/p99 per histogram) and
+# metrics_<name>.prom in the Prometheus textfile format (node_exporter --collector.textfile).
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# seconds. single snmp requests sit in the low ones, a whole discovery pass in the high ones
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PREFIX = "printer_"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    # upper edge of the bucket the quantile falls in, good enough to see where time goes
+    def quantile(self, q):
+        if not self.count:
+            return None
+        wanted = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 6),
+        }
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> number
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.local = threading.local()
+        self.started = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    # time a block into the "<name>_seconds" histogram. the yielded dict is the label set,
+    # so the outcome can be added once it's known. an exception is recorded as outcome=error
+    @contextmanager
+    def timed(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels.setdefault("outcome", "error")
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    # labels for whatever this thread does next (the sweep runs each printer on one thread)
+    def context(self, **labels):
+        self.local.labels = {**self.current(), **labels}
+
+    def current(self):
+        return getattr(self.local, "labels", {})
+
+    def clear_context(self):
+        self.local.labels = {}
+
+    # start over, for a process that runs the scripts more than once (_scheduler.py --daemon)
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    # the raw numbers, to add into another process's registry with merge() (more_python/process_sweep.py)
+    def export(self):
+        with self.lock:
+            return {
+                "counters": list(self.counters.items()),
+                "histograms": [(key, histogram.counts, histogram.count, histogram.sum, histogram.max)
+                               for key, histogram in self.histograms.items()],
+            }
+
+    def merge(self, exported):
+        with self.lock:
+            for key, value in exported["counters"]:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, counts, count, total, maximum in exported["histograms"]:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                histogram = self.histograms[key]
+                histogram.counts = [mine + theirs for mine, theirs in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+                histogram.max = max(histogram.max, maximum)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), {key: histogram.summary() for key, histogram in self.histograms.items()}
+
+    def to_json(self, script=""):
+        counters, histograms = self.snapshot()
+        return {
+            "script": script,
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            "finished": datetime.now().isoformat(timespec='seconds'),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), **summary}
+                           for (name, labels), summary in sorted(histograms.items())],
+        }
+
+    def to_prometheus(self, script=""):
+        extra = (("script", script),) if script else ()
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{PREFIX}{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_label_text(labels, extra)} {value}")
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{PREFIX}{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                seen = 0
+                for edge, count in zip(list(BUCKETS) + ["+Inf"], histogram.counts):
+                    seen += count
+                    lines.append(f"{metric}_bucket{_label_text(labels, extra + (('le', edge),))} {seen}")
+                lines.append(f"{metric}_sum{_label_text(labels, extra)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_label_text(labels, extra)} {histogram.count}")
+
+            lines.append(f"# TYPE {PREFIX}last_run_timestamp_seconds gauge")
+            lines.append(f"{PREFIX}last_run_timestamp_seconds{_label_text((), extra)} {int(time.time())}")
+        return "\n".join(lines) + "\n"
+
+    # metrics_<script>.json and metrics_<script>.prom in directory, returns the two paths
+    def save(self, directory, script):
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for extension, text in (("json", json.dumps(self.to_json(script), indent=1)),
+                                ("prom", self.to_prometheus(script))):
+            path = os.path.join(directory, f"metrics_{script}.{extension}")
+            # temp file + rename, the textfile collector must never read half a file
+            with open(path + ".tmp", 'w') as file:
+                file.write(text)
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return paths
+
+
+# one registry per process, the scripts and more_python modules all record into this
+registry = Metrics()
+inc = registry.inc
+observe = registry.observe
+timed = registry.timed
+context = registry.context
+current = registry.current
+clear_context = registry.clear_context
+save = registry.save
+reset = registry.reset
+export = registry.export
+merge = registry.merge
+
+
+# short vendor name for labels, so a label doesn't get one value per model
+def vendor_of(model):
+    words = (model or "").split()
+    return words[0].lower() if words else "unknown"
@@ -0,0 +1,115 @@
+# more_python/neighbor_prefilter.py
+
+# Addresses we already know are up, from the kernel's neighbor (ARP) table and from lease/ARP dumps
+# exported off the DHCP server or a switch. The finder probes those first and sweeps the rest after,
+# so the printers that are on show up without waiting behind a subnet full of ping timeouts.
+#
+#   live = known_live('/proc/net/arp', ['/srv/dumps/dhcpd.leases'])
+#   for name, batch in passes(ips, live, 'first'):     # known live, then everything else
+#       scan(batch)
+#
+# mode 'first' probes the known ones, then the rest. 'only' skips the rest, except for a list with no
+# known address in it at all (a routed subnet never shows up in this machine's ARP table), which is
+# swept in full. 'off' leaves the list alone. Addresses the finder skips anyway (x.x.x.1, the gateway
+# that's in every local ARP table) don't count as known.
+# testing/neighbor_prefilter_check.py runs these against the files in testing/fixtures/.
+
+import ipaddress
+import re
+
+from more_python.finder import is_skipped_ip
+
+ATF_COM = 0x2  # /proc/net/arp flag for a complete entry, the host answered ARP
+IP_PATTERN = re.compile(r'(?<![\d.])(\d{1,3}(?:\.\d{1,3}){3})(?![\d.])')
+
+
+def _valid_ip(text):
+    try:
+        return str(ipaddress.IPv4Address(text))
+    except ValueError:
+        return None
+
+
+# IPs with a complete entry in a /proc/net/arp style table:
+#   IP address       HW type     Flags       HW address            Mask     Device
+#   10.1.2.40        0x1         0x2         00:1b:a9:12:34:56     *        eth0
+def read_arp_table(path='/proc/net/arp'):
+    live = set()
+    try:
+        with open(path) as file:
+            lines = file.readlines()[1:]
+    except OSError:
+        return live
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            flags = int(fields[2], 16)
+        except ValueError:
+            continue
+        ip = _valid_ip(fields[0])
+        if ip and flags & ATF_COM and fields[3] != "00:00:00:00:00:00":
+            live.add(ip)
+    return live
+
+
+# IPs from an exported lease or ARP dump. ISC dhcpd.leases files are read lease by lease and only
+# active ones count, anything else (dnsmasq leases, `arp -a` output, a CSV, one IP per line) gives
+# the first IP on each line that isn't marked incomplete
+def read_lease_dump(path):
+    try:
+        with open(path) as file:
+            text = file.read()
+    except OSError:
+        print(f"can't read lease dump {path}, skipping it")
+        return set()
+    if re.search(r'^\s*lease\s+\S+\s*\{', text, re.MULTILINE):
+        return _read_dhcpd_leases(text)
+
+    live = set()
+    for line in text.splitlines():
+        if line.lstrip().startswith('#') or 'incomplete' in line.lower():
+            continue
+        match = IP_PATTERN.search(line)
+        ip = match and _valid_ip(match.group(1))
+        if ip:
+            live.add(ip)
+    return live
+
+
+def _read_dhcpd_leases(text):
+    live = set()
+    for ip, body in re.findall(r'^\s*lease\s+(\S+)\s*\{(.*?)^\s*\}', text, re.MULTILINE | re.DOTALL):
+        ip = _valid_ip(ip)
+        if not ip:
+            continue
+        state = re.search(r'^\s*binding state\s+(\w+)\s*;', body, re.MULTILINE)
+        if state and state.group(1) != 'active':
+            live.discard(ip)  # a later entry for the same IP wins, like dhcpd reads the file
+        else:
+            live.add(ip)
+    return live
+
+
+def known_live(arp_table='/proc/net/arp', lease_dumps=()):
+    live = read_arp_table(arp_table) if arp_table else set()
+    for path in lease_dumps or ():
+        live |= read_lease_dump(path)
+    return live
+
+
+# the IPs split into the lists to scan, one after the other, as (name, ips) pairs:
+#   [("known live", [...]), ("the rest", [...])], or [("all", ips)] when there's nothing to split
+# keeps the order of ips inside each list
+def passes(ips, live, mode='first'):
+    ips = list(ips)
+    if mode == 'off' or live is None:
+        return [("all", ips)]
+    known = [ip for ip in ips if ip in live and not is_skipped_ip(ip)]
+    if not known:
+        return [("all", ips)]
+    if mode == 'only':
+        return [("known live", known)]
+    known_set = set(known)
+    return [("known live", known), ("the rest", [ip for ip in ips if ip not in known_set])]
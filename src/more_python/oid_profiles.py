@@ -0,0 +1,41 @@
+# more_python/oid_profiles.py
+
+from more_python.json_cache import JsonCache
+
+
+# Remembers which counter OID actually worked for each printer, so the next run asks for
+# that one OID instead of the whole candidate list from printer_oids.yaml.
+# Keyed by serial (falling back to model for printers that don't report one):
+#   {"serial:RP61703537": {"bw": "1.3.6...", "color": "1.3.6..."}, "model:ECOSYS P3260dn": {...}}
+class OidProfiles(JsonCache):
+    def _keys(self, serial, model):
+        keys = []
+        if serial:
+            keys.append(f"serial:{serial}")
+        if model:
+            keys.append(f"model:{model}")
+        return keys
+
+    # the OID that worked last time for kind ('bw' or 'color'), or None
+    def winning(self, serial, model, kind):
+        for key in self._keys(serial, model):
+            oid = (self.get(key) or {}).get(kind)
+            if oid:
+                return oid
+        return None
+
+    def remember(self, serial, model, kind, oid):
+        for key in self._keys(serial, model):
+            profile = dict(self.get(key) or {})
+            profile[kind] = oid
+            self.set(key, profile)
+
+    # the remembered OID stopped answering, drop it so the full list gets tried again
+    def forget(self, serial, model, kind):
+        for key in self._keys(serial, model):
+            profile = dict(self.get(key) or {})
+            if profile.pop(kind, None) is not None:
+                if profile:
+                    self.set(key, profile)
+                else:
+                    self.pop(key)
@@ -0,0 +1,88 @@
+# more_python/oid_resolver.py
+
+import os
+import re
+
+import yaml
+
+DEFAULT_TABLES = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'printer_oids.yaml')
+
+
+def normalize(text):
+    return text.lower().replace(" ", "")
+
+
+# Picks the counter OIDs for a printer model from printer_oids.yaml.
+# The file is read once and turned into an exact-match dict plus one compiled regex per
+# kind (bw/color) holding every vendor string, so a lookup costs the same with 10 models
+# or 500. Results are remembered per model since the same few models come up over and over.
+class OidResolver:
+    def __init__(self, tables):
+        self.default = tables['default']
+        self.known = {}  # kind -> {normalized model: [oids]}
+        self.vendor_oids = {}  # kind -> [[oids], ...] in file order (= priority)
+        self.vendor_tokens = {}  # kind -> {normalized match string: priority}
+        self.matchers = {}  # kind -> compiled regex over every vendor match string
+        self.cache = {}  # (kind, normalized model) -> [oids]
+
+        for kind in ('bw', 'color'):
+            self.known[kind] = {
+                normalize(model): entry[kind]
+                for model, entry in (tables.get('known') or {}).items()
+                if kind in entry
+            }
+
+            self.vendor_oids[kind] = []
+            tokens = {}
+            for entry in tables.get('vendors') or []:
+                if kind not in entry:
+                    continue
+                priority = len(self.vendor_oids[kind])
+                self.vendor_oids[kind].append(entry[kind])
+                for token in entry['match']:
+                    token = normalize(str(token))
+                    if token:
+                        tokens.setdefault(token, priority)  # an earlier entry keeps the string
+            self.vendor_tokens[kind] = tokens
+
+            # a lookahead finds every match string at every position (even overlapping ones),
+            # and the alternation lists them highest priority first
+            ordered = sorted(tokens, key=lambda token: (tokens[token], -len(token)))
+            self.matchers[kind] = re.compile(
+                "(?=(" + "|".join(re.escape(token) for token in ordered) + "))") if ordered else None
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_TABLES):
+        with open(path, 'r') as file:
+            return cls(yaml.safe_load(file))
+
+    # OIDs to try for kind ('bw' or 'color'), in order
+    def resolve(self, kind, model):
+        normalized_model = normalize(model)
+        key = (kind, normalized_model)
+        if key not in self.cache:
+            self.cache[key] = self._resolve(kind, normalized_model)
+        return self.cache[key]
+
+    # True if the model has its own list in known:, not just a vendor guess or the default
+    def is_known(self, kind, model):
+        return normalize(model) in self.known[kind]
+
+    # True if known: or a vendor entry has OIDs for the model, False if it'd get the default
+    def has_entry(self, kind, model):
+        return self.resolve(kind, model) != [self.default] or self.is_known(kind, model)
+
+    def _resolve(self, kind, normalized_model):
+        # 1. exact model
+        if normalized_model in self.known[kind]:
+            return list(self.known[kind][normalized_model])
+
+        # 2. vendor strings, the earliest entry in the file wins
+        matcher = self.matchers[kind]
+        if matcher:
+            hits = [self.vendor_tokens[kind][match.group(1)] for match in matcher.finditer(normalized_model)]
+            if hits:
+                return list(self.vendor_oids[kind][min(hits)])
+
+        # 3. default
+        return [self.default]
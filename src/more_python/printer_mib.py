@@ -0,0 +1,43 @@
+# more_python/printer_mib.py
+
+# Page count and colorants from the standard Printer-MIB (RFC 3805) tables, for printers that
+# don't need a guessed vendor OID. The three columns are walked together with GETBULK (SNMPv2c),
+# which is one round trip for a normal printer.
+#
+# The Printer-MIB only has a lifetime total per marker, not a b/w and color split, so the total
+# is only the b/w count for b/w printers. color printers still need the vendor OIDs for the split.
+
+from more_python import snmp_client
+
+MARKER_LIFE_COUNT = "1.3.6.1.2.1.43.10.2.1.4"  # prtMarkerLifeCount, one per marker (print engine)
+COLORANT_VALUE = "1.3.6.1.2.1.43.12.1.1.4"  # prtMarkerColorantValue: "black", "cyan", ...
+SUPPLIES_DESCRIPTION = "1.3.6.1.2.1.43.11.1.1.6"  # prtMarkerSuppliesDescription: "Toner (Cyan)", "TK-3182", ...
+
+COLOR_NAMES = ('cyan', 'magenta', 'yellow')
+
+
+# (total, is_color) or None if the printer doesn't have the marker table.
+# is_color comes from the colorant table, which lists every colorant the printer has. without one
+# the supply descriptions are checked for color names, but some printers only put part numbers
+# there ("TK-5242CS"), so no color name there means None (don't know) and not b/w
+def read_printer_mib(ip, community='public', port=None):
+    tables = snmp_client.bulk_walk_many(ip, [MARKER_LIFE_COUNT, COLORANT_VALUE, SUPPLIES_DESCRIPTION], community,
+                                        port=port)
+
+    counts = [value.strip() for _, value in tables[MARKER_LIFE_COUNT] if value.strip().isdigit()]
+    if not counts:
+        return None
+
+    colorants = [value.lower() for _, value in tables[COLORANT_VALUE]]
+    supplies = [value.lower() for _, value in tables[SUPPLIES_DESCRIPTION]]
+    if colorants:
+        is_color = has_color_name(colorants)
+    else:
+        is_color = True if has_color_name(supplies) else None
+
+    # the first marker is the one default_oid (prtMarkerLifeCount.1.1) always read
+    return counts[0], is_color
+
+
+def has_color_name(values):
+    return any(name in value for value in values for name in COLOR_NAMES)
@@ -0,0 +1,73 @@
+# more_python/printer_reading.py
+
+import csv
+from datetime import datetime
+
+
+def to_count(value):
+    value = str(value).strip() if value is not None else ""
+    return int(value) if value.isdigit() else None
+
+
+# One printer's result from one counter run. The counter makes these and the same object goes
+# to the console, TodaysLog, the count store and the totals CSV, nothing gets turned into a
+# "a,b,c" string and split again. __slots__ because a big fleet makes a lot of them.
+class PrinterReading:
+    __slots__ = ('ip', 'model', 'serial', 'bw', 'color', 'answered', 'ts')
+
+    def __init__(self, ip, model="", serial="", bw=None, color=None, answered=True, ts=None):
+        self.ip = ip
+        self.model = model or ""
+        self.serial = serial or ""
+        self.bw = to_count(bw)  # int or None
+        self.color = to_count(color)
+        self.answered = answered
+        self.ts = ts  # "YYYY-MM-DD HH:MM:SS" of the run, set when it's stored
+
+    @classmethod
+    def no_response(cls, ip, ts=None):
+        return cls(ip, answered=False, ts=ts)
+
+    # what identifies the printer across runs, the IP only if it never gave a serial
+    @property
+    def key(self):
+        return self.serial or f"ip:{self.ip}"
+
+    def __repr__(self):
+        return f"PrinterReading({self.ip!r}, {self.model!r}, {self.serial!r}, bw={self.bw}, color={self.color})"
+
+
+def _blank(value):
+    return "" if value is None else value
+
+
+# Writes the wide totals_YYYY_MM.csv straight from readings, one run at a time:
+#   Mon YYYY, IP:,   ip,    ip,    ...
+#   ,         Model, model, ,      ...
+#   ,         Serial,serial, <--,  ...
+#   Date,     Time,  b/w,   color, ...
+#   date,     time,  count, count, ...   one line per write_run()
+# devices: one reading per printer (for the ip/model/serial header), in column order
+class WideCsvWriter:
+    def __init__(self, file, month, devices):
+        self.writer = csv.writer(file)
+        self.keys = [device.key for device in devices]
+
+        header, models, serials, types = [datetime.strptime(month, "%Y-%m").strftime("%b %Y"), "IP:"], \
+            ["", "Model"], ["", "Serial"], ["Date", "Time"]
+        for device in devices:
+            header += [device.ip, device.ip]
+            models += [device.model, ""]
+            serials += [device.serial, " <--" if device.serial else ""]
+            types += ["b/w", "color"]
+        self.writer.writerows([header, models, serials, types])
+
+    # readings: the run's readings, any order. printers missing from it get blank columns
+    def write_run(self, ts, readings):
+        by_key = {reading.key: reading for reading in readings}
+        date, _, time = ts.partition(" ")
+        row = [date, time]
+        for key in self.keys:
+            reading = by_key.get(key)
+            row += [_blank(reading.bw), _blank(reading.color)] if reading else ["", ""]
+        self.writer.writerow(row)
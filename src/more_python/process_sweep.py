@@ -0,0 +1,169 @@
+# more_python/process_sweep.py
+
+# The finder's sweep spread over several processes, for address spaces too big for one core
+# (a few /16s). One process with the async sweep ends up waiting on its own CPU once there's enough
+# SNMP encoding/decoding and classifying going on, the GIL keeps the probe threads on one core.
+#
+#   with ProcessSweep(processes=0, community="public", max_in_flight=64) as pool:   # 0 = one per core
+#       for subnet in subnets:
+#           pool.run(generate_ips_in_subnet(subnet), on_result)
+#
+# The IPs are cut into chunks of chunk_size addresses in a row (so each chunk mostly stays in one
+# subnet, which the adaptive timeouts in snmp_client like) and put on a queue. Every worker process
+# takes a chunk, runs finder.probe_all() on it (host discovery, then its own asyncio sweep) and puts
+# the results on the results queue. on_result(ip, result) is called in the parent, in the order the
+# IPs were given, same as async_sweep.sweep(), so the CSV and the logs come out the same.
+# The workers stay up between run() calls, their metrics are added to this process's at close().
+
+import multiprocessing
+import os
+import queue
+import traceback
+
+from more_python import finder
+from more_python import metrics
+from more_python import snmp_client
+from more_python import rate_limit
+
+CHUNK_SIZE = 256
+# snmp_client settings the scripts set from settings.yaml, copied into every worker
+SNMP_SETTINGS = ('SNMP_PORT', 'TIMEOUT', 'RETRIES', 'MIN_TIMEOUT', 'MAX_TIMEOUT', 'HOST_FAIL_LIMIT',
+                 'ADAPTIVE_TIMEOUTS')
+RATE_SETTINGS = ('RATE', 'BURST', 'SUBNET_RATE', 'SUBNET_BURST', 'HOST_IN_FLIGHT')
+
+
+# the cores this process may run on
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS doesn't have it
+        return os.cpu_count() or 1
+
+
+def chunks(ips, size):
+    chunk = []
+    for ip in ips:
+        chunk.append(ip)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ProcessSweep:
+    # scan_settings are finder.probe_all()'s keyword arguments (community, max_in_flight, ...),
+    # max_in_flight is per worker process
+    def __init__(self, processes=0, chunk_size=CHUNK_SIZE, **scan_settings):
+        self.processes = processes if processes and processes > 0 else available_cores()
+        self.chunk_size = max(1, int(chunk_size))
+        self.scan_settings = scan_settings
+        self.workers = []
+        self.next_chunk = 0  # chunk numbers keep counting up over run() calls
+
+    def start(self):
+        # spawn, not fork: the parent has threads going (the log sinks) and fork only copies the one
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        snmp_settings = {name: getattr(snmp_client, name) for name in SNMP_SETTINGS}
+        # the packet rates are for the whole sweep, so every worker gets its share
+        rate_settings = {name: getattr(rate_limit, name) for name in RATE_SETTINGS}
+        for name in ('RATE', 'SUBNET_RATE', 'BURST', 'SUBNET_BURST'):
+            rate_settings[name] = rate_settings[name] / self.processes
+        for number in range(self.processes):
+            worker = context.Process(target=_worker, name=f"sweep worker {number + 1}",
+                                     args=(self.tasks, self.results, self.scan_settings, snmp_settings, rate_settings),
+                                     daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def run(self, ips, on_result):
+        if not self.workers:
+            self.start()
+
+        first = self.next_chunk
+        for chunk in chunks(ips, self.chunk_size):
+            self.tasks.put((self.next_chunk, chunk))
+            self.next_chunk += 1
+
+        finished = {}  # chunk number -> results, waiting for earlier chunks
+        next_to_emit = first
+        while next_to_emit < self.next_chunk:
+            kind, number, payload = self._get()
+            if kind == "error":
+                raise RuntimeError(f"sweep worker failed on chunk {number}:\n{payload}")
+            finished[number] = payload
+            while next_to_emit in finished:
+                for ip, result in finished.pop(next_to_emit):
+                    on_result(ip, result)
+                next_to_emit += 1
+
+    # the next message from the workers. waits in short steps so a worker that died doesn't hang the run
+    def _get(self):
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("all sweep workers exited before the sweep was done")
+
+    def close(self):
+        if not self.workers:
+            return
+        for _ in self.workers:
+            self.tasks.put(None)
+        # each worker sends its metrics on the way out (after any chunks left over from a failed run)
+        remaining = len(self.workers)
+        while remaining:
+            try:
+                kind, _, payload = self._get()
+            except RuntimeError:
+                break
+            if kind == "metrics":
+                metrics.merge(payload)
+                remaining -= 1
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+    # for Ctrl+C and errors: no metrics, just stop them
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def _worker(tasks, results, scan_settings, snmp_settings, rate_settings):
+    for name, value in snmp_settings.items():
+        setattr(snmp_client, name, value)
+    for name, value in rate_settings.items():
+        setattr(rate_limit, name, value)
+    while True:
+        try:
+            task = tasks.get()
+        except KeyboardInterrupt:
+            return  # Ctrl+C reaches every process in the group, the parent deals with it
+        if task is None:
+            break
+        number, ips = task
+        try:
+            found = []
+            finder.probe_all(ips, lambda ip, result: found.append((ip, result)), **scan_settings)
+            results.put(("chunk", number, found))
+        except KeyboardInterrupt:
+            return
+        except Exception:
+            results.put(("error", number, traceback.format_exc()))
+    results.put(("metrics", None, metrics.export()))
@@ -0,0 +1,95 @@
+# more_python/rate_limit.py
+
+# Keeps the SNMP traffic polite. With max_in_flight, sweep_processes and the UDP discovery pass the
+# finder can send thousands of packets a second, which is enough to fill a branch office link or
+# set off the IDS on a core switch.
+#
+# Every request snmp_client sends and every discovery packet goes through acquire(ip) first:
+#   - a token bucket for everything: RATE packets per second, up to BURST at once after a quiet spell
+#   - a token bucket per /24 (the same subnets snmp_client keeps its round trip times for):
+#     SUBNET_RATE packets per second, SUBNET_BURST at once
+#   - at most HOST_IN_FLIGHT requests waiting on one host at the same time (host_slot)
+# 0 turns each of them off, which is the default. The scripts set these from settings.yaml.
+# A request counts as one packet, pysnmp's own retries after a timeout aren't counted.
+# The limits are per process, process_sweep.py splits the rates between its workers.
+
+import threading
+import time
+from contextlib import contextmanager
+
+from more_python import metrics
+
+RATE = 0  # packets per second over everything
+BURST = 50
+SUBNET_RATE = 0  # packets per second to one /24
+SUBNET_BURST = 10
+HOST_IN_FLIGHT = 0  # requests at once to one host
+
+_lock = threading.Lock()
+_slots = threading.Condition(_lock)
+_buckets = {}  # None for the global bucket, "10.1.2" for a subnet -> [tokens, last refill]
+_in_flight = {}  # ip -> requests going right now
+
+
+def _subnet(ip):
+    return ip.rsplit('.', 1)[0]
+
+
+# take one token from the bucket, returns how long to wait for it. the token is taken either way
+# (the bucket goes below zero), so threads queue up behind each other instead of all waking at once
+def _take(key, rate, burst, now):
+    burst = max(1, burst)
+    tokens, last = _buckets.get(key, (burst, now))
+    tokens = min(burst, tokens + (now - last) * rate) - 1
+    _buckets[key] = [tokens, now]
+    return -tokens / rate if tokens < 0 else 0.0
+
+
+# wait until a packet to ip is allowed
+def acquire(ip):
+    if RATE <= 0 and SUBNET_RATE <= 0:
+        return
+    with _lock:
+        now = time.monotonic()
+        wait = 0.0
+        if RATE > 0:
+            wait = _take(None, RATE, BURST, now)
+        if SUBNET_RATE > 0:
+            wait = max(wait, _take(_subnet(ip), SUBNET_RATE, SUBNET_BURST, now))
+    if wait > 0:
+        metrics.observe("rate_limit_wait_seconds", wait)
+        time.sleep(wait)
+
+
+# around a request that waits for an answer, keeps to HOST_IN_FLIGHT at once per host
+@contextmanager
+def host_slot(ip):
+    if HOST_IN_FLIGHT <= 0:
+        yield
+        return
+    with _slots:
+        if _in_flight.get(ip, 0) >= HOST_IN_FLIGHT:
+            metrics.inc("rate_limit_host_waits")
+            while _in_flight.get(ip, 0) >= HOST_IN_FLIGHT:
+                _slots.wait()
+        _in_flight[ip] = _in_flight.get(ip, 0) + 1
+    try:
+        yield
+    finally:
+        with _slots:
+            _in_flight[ip] -= 1
+            if not _in_flight[ip]:
+                del _in_flight[ip]
+            _slots.notify_all()
+
+
+# the settings from settings.yaml, for both scripts
+def configure(config):
+    global RATE, BURST, SUBNET_RATE, SUBNET_BURST, HOST_IN_FLIGHT
+    RATE = config.get('snmp_rate', RATE)
+    BURST = config.get('snmp_burst', BURST)
+    SUBNET_RATE = config.get('snmp_subnet_rate', SUBNET_RATE)
+    SUBNET_BURST = config.get('snmp_subnet_burst', SUBNET_BURST)
+    HOST_IN_FLIGHT = config.get('snmp_host_in_flight', HOST_IN_FLIGHT)
+    with _lock:
+        _buckets.clear()
@@ -0,0 +1,301 @@
+# more_python/snmp_client.py
+
+# One place for every SNMP request in the project.
+# Building a SnmpEngine (and loading its MIBs) for every GET was most of the CPU time,
+# so each thread keeps one engine for its whole life and reuses the community/target
+# objects for every printer it talks to. pysnmp's engine isn't thread safe, which is why
+# it's one per thread and not one per process (the async sweep runs probes on a thread pool).
+#
+# Timeouts: pysnmp's default is 1 s and 5 retries for every request, so a host that pings but has
+# SNMP off cost ~6 s per request. Instead the timeout follows the round trip times seen on each /24
+# (srtt + 4 * rttvar like TCP, clamped to MIN_TIMEOUT..MAX_TIMEOUT), and a host that times out
+# HOST_FAIL_LIMIT requests in a row isn't asked again for the rest of the run.
+# Every request waits for more_python/rate_limit.py first (packets per second, requests per host).
+
+import threading
+import time
+
+from more_python import metrics
+from more_python import rate_limit
+
+SNMP_PORT = 161  # the scripts set this from snmp_port in settings.yaml
+MAX_VARBINDS = 24  # keeps a request well under the 484 byte PDU every agent has to accept
+
+# the scripts set these from settings.yaml (snmp_timeout, snmp_retries, ...)
+TIMEOUT = 1.0  # seconds, until a subnet has answered at least once
+RETRIES = 2
+MIN_TIMEOUT = 0.3  # some embedded agents take a few hundred ms to build an answer
+MAX_TIMEOUT = 3.0
+HOST_FAIL_LIMIT = 2  # 0 = never give up on a host
+ADAPTIVE_TIMEOUTS = True
+TIMER_RESOLUTION = 0.05  # pysnmp checks for timeouts every 0.5 s by default, too coarse for 0.1 s timeouts
+
+_local = threading.local()
+_lock = threading.Lock()
+_rtt = {}  # "10.1.2" -> [srtt, rttvar]
+_failures = {}  # ip -> timeouts in a row, only for hosts that are failing right now
+_hlapi = None  # pysnmp.hlapi, imported by the first request. importing pysnmp takes a good part of a second
+
+
+# called by the first request, or up front by something that wants to pay for it early (_scheduler.py --daemon)
+def load_pysnmp():
+    global _hlapi
+    if _hlapi is None:
+        from pysnmp import hlapi
+        _hlapi = hlapi
+    return _hlapi
+
+
+def _state():
+    if not hasattr(_local, 'engine'):
+        load_pysnmp()
+        _local.engine = _hlapi.SnmpEngine()
+        _local.context = _hlapi.ContextData()
+        _local.communities = {}  # (community, mp_model) -> CommunityData
+        _local.targets = {}  # (ip, port) -> UdpTransportTarget
+        _local.warm = False  # the first request on a new engine also pays for loading the MIBs
+    return _local
+
+
+def _community(state, community, mp_model):
+    key = (community, mp_model)
+    if key not in state.communities:
+        state.communities[key] = _hlapi.CommunityData(community, mpModel=mp_model)
+    return state.communities[key]
+
+
+def _target(state, ip, port):
+    key = (ip, port)
+    if key not in state.targets:
+        state.targets[key] = _hlapi.UdpTransportTarget((ip, port), timeout=TIMEOUT, retries=RETRIES)
+    target = state.targets[key]
+    target.timeout = timeout_for(ip)
+    target.retries = RETRIES
+    return target
+
+
+def _subnet(ip):
+    return ip.rsplit('.', 1)[0]
+
+
+# timeout for the next request to ip, from the RTTs seen on its /24
+def timeout_for(ip):
+    if not ADAPTIVE_TIMEOUTS:
+        return TIMEOUT
+    with _lock:
+        estimate = _rtt.get(_subnet(ip))
+    if estimate is None:
+        return TIMEOUT
+    srtt, rttvar = estimate
+    timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, srtt + 4 * rttvar))
+    # pysnmp keeps a config entry per (host, timeout), rounding keeps that from growing with every sample
+    return round(timeout * 20) / 20
+
+
+def _record_rtt(ip, seconds):
+    key = _subnet(ip)
+    with _lock:
+        if key not in _rtt:
+            _rtt[key] = [seconds, seconds / 2]
+        else:
+            srtt, rttvar = _rtt[key]
+            rttvar = 0.75 * rttvar + 0.25 * abs(srtt - seconds)
+            srtt = 0.875 * srtt + 0.125 * seconds
+            _rtt[key] = [srtt, rttvar]
+        _failures.pop(ip, None)
+
+
+def _record_timeout(ip):
+    with _lock:
+        _failures[ip] = _failures.get(ip, 0) + 1
+
+
+# True once ip has timed out HOST_FAIL_LIMIT requests in a row
+def is_abandoned(ip):
+    if HOST_FAIL_LIMIT <= 0:
+        return False
+    with _lock:
+        return _failures.get(ip, 0) >= HOST_FAIL_LIMIT
+
+
+# a new run gives every host another chance. the round trip times are kept, they're still good
+def new_run():
+    with _lock:
+        _failures.clear()
+
+
+# after each request: an answer that came before the first timeout is a clean RTT sample
+# (an answer after a retry can't be matched to the attempt it answers, so it's left out)
+def _record(state, ip, seconds, timeout, errorIndication):
+    warm, state.warm = state.warm, True
+    if not warm and state.engine.transportDispatcher:
+        # the dispatcher only exists once the engine has sent something
+        state.engine.transportDispatcher.setTimerResolution(TIMER_RESOLUTION)
+    if errorIndication:
+        if "timeout" in str(errorIndication).lower():
+            _record_timeout(ip)
+    elif seconds < timeout and warm:
+        _record_rtt(ip, seconds)
+    else:
+        with _lock:
+            _failures.pop(ip, None)
+
+
+# noSuchObject / noSuchInstance / endOfMibView come back as values in v2c, treat them as "no value".
+# strings are str() like the scripts always did: prettyPrint() turns anything with a non-printable
+# byte (a serial ending in \x00, a sysDescr ending in CRLF) into a 0x... hex dump
+def _value(value):
+    if isinstance(value, (_hlapi.NoSuchObject, _hlapi.NoSuchInstance, _hlapi.EndOfMibView)):
+        return None
+    if isinstance(value, _hlapi.OctetString) and not isinstance(value, _hlapi.IpAddress):
+        return str(value)
+    return value.prettyPrint()
+
+
+# GET a single OID, returns the value as a string or None
+def get(ip, oid, community='public', mp_model=0, port=None):
+    return get_many(ip, [oid], community, mp_model, port)[oid]
+
+
+# first OID in the list that has a non-empty value, for "try these in order" fallbacks
+def first_value(values, oids):
+    for oid in oids:
+        if values.get(oid):
+            return values[oid]
+    return None
+
+
+# what get_many() returns: {oid: value or None}, and in .timed_out the OIDs the device never answered
+# for (timeout, or a host given up on). None for an OID not in .timed_out means the device said it has no such thing
+class Values(dict):
+    def __init__(self, values, timed_out=()):
+        super().__init__(values)
+        self.timed_out = set(timed_out)
+
+
+# True if the device answered for oid, even if the answer was "no such object".
+# for a plain dict nobody knows, so only a value counts
+def answered(values, oid):
+    timed_out = getattr(values, 'timed_out', None)
+    if timed_out is None:
+        return values.get(oid) is not None
+    return oid in values and oid not in timed_out
+
+
+# GET several OIDs from one device, returns Values ({oid: value or None}) in the order asked for.
+# All the OIDs go out in as few PDUs as possible (MAX_VARBINDS per PDU) instead of one request each.
+def get_many(ip, oids, community='public', mp_model=0, port=None):
+    state = _state()
+    port = port or SNMP_PORT
+    oids = list(dict.fromkeys(oids))  # drop duplicates, keep order
+    results = dict.fromkeys(oids)
+    timed_out = set()
+    for i in range(0, len(oids), MAX_VARBINDS):
+        if is_abandoned(ip):
+            timed_out.update(oids[i:])
+            metrics.inc("snmp_abandoned_requests", phase=metrics.current().get("phase"))
+            break
+        _get_batch(state, ip, oids[i:i + MAX_VARBINDS], community, mp_model, port, results, timed_out)
+
+    vendor = metrics.current().get("vendor")
+    for oid, value in results.items():
+        outcome = "timeout" if oid in timed_out else "missing" if value is None else "value"
+        metrics.inc("snmp_oids", oid=oid, vendor=vendor, outcome=outcome)
+    return Values(results, timed_out)
+
+
+def _get_batch(state, ip, oids, community, mp_model, port, results, timed_out):
+    while oids:
+        target = _target(state, ip, port)
+        with rate_limit.host_slot(ip):
+            rate_limit.acquire(ip)
+            start = time.perf_counter()
+            errorIndication, errorStatus, errorIndex, varBinds = next(
+                _hlapi.getCmd(state.engine,
+                       _community(state, community, mp_model),
+                       target,
+                       state.context,
+                       *[_hlapi.ObjectType(_hlapi.ObjectIdentity(oid)) for oid in oids])
+            )
+        _record(state, ip, time.perf_counter() - start, target.timeout, errorIndication)
+        _observe("get", start, errorIndication, errorStatus)
+        if errorIndication:
+            timed_out.update(oids)
+            return  # timeout etc, everything stays None
+
+        if errorStatus:
+            # SNMPv1 fails the whole PDU when one OID is missing (noSuchName) and points at it
+            # with errorIndex. drop that one and ask again for the rest
+            bad = int(errorIndex) - 1
+            if 0 <= bad < len(oids):
+                oids = oids[:bad] + oids[bad + 1:]
+                continue
+            if str(errorStatus) == 'tooBig' and len(oids) > 1:
+                half = len(oids) // 2
+                _get_batch(state, ip, oids[:half], community, mp_model, port, results, timed_out)
+                oids = oids[half:]
+                continue
+            return
+
+        # v2c answers every varbind, missing ones come back as noSuchObject/noSuchInstance
+        for oid, (name, value) in zip(oids, varBinds):
+            results[oid] = _value(value)
+        return
+
+
+# one snmp_request_seconds sample per PDU, labelled with what the calling thread is doing (metrics.context)
+def _observe(op, start, errorIndication, errorStatus=None):
+    if errorIndication:
+        outcome = "timeout" if "timeout" in str(errorIndication).lower() else "error"
+    elif errorStatus:
+        outcome = str(errorStatus)
+    else:
+        outcome = "ok"
+    labels = metrics.current()
+    metrics.observe("snmp_request_seconds", time.perf_counter() - start,
+                    op=op, phase=labels.get("phase"), vendor=labels.get("vendor"), outcome=outcome)
+
+
+# Walk everything under an OID with GETBULK (needs SNMPv2c), returns [(oid, value), ...]
+def bulk_walk(ip, oid, community='public', max_repetitions=25, port=None):
+    return bulk_walk_many(ip, [oid], community, max_repetitions, port)[oid]
+
+
+# Walk several table columns side by side, each GETBULK carries a row of every column, so small
+# tables come back in one round trip. returns {column oid: [(oid, value), ...]}
+def bulk_walk_many(ip, oids, community='public', max_repetitions=25, port=None):
+    state = _state()
+    port = port or SNMP_PORT
+    oids = list(dict.fromkeys(oids))
+    rows = {oid: [] for oid in oids}
+    if is_abandoned(ip):
+        metrics.inc("snmp_abandoned_requests", phase=metrics.current().get("phase"))
+        return rows
+    target = _target(state, ip, port)
+    # one packet as far as the rate limit goes, small tables come back in one round trip
+    with rate_limit.host_slot(ip):
+        rate_limit.acquire(ip)
+        start = time.perf_counter()
+        errorIndication = errorStatus = None
+        first = True
+        # pysnmp hands back one row at a time, so only the first one is a round trip time
+        for errorIndication, errorStatus, errorIndex, varBinds in _hlapi.bulkCmd(
+                state.engine,
+                _community(state, community, 1),
+                target,
+                state.context,
+                0, max_repetitions,
+                *[_hlapi.ObjectType(_hlapi.ObjectIdentity(oid)) for oid in oids],
+                lexicographicMode=False):
+            if first:
+                _record(state, ip, time.perf_counter() - start, target.timeout, errorIndication)
+                first = False
+            if errorIndication or errorStatus:
+                break
+            # columns that ran past their table come back as endOfMibView, _value drops them
+            for column, (name, value) in zip(oids, varBinds):
+                value = _value(value)
+                if value is not None:
+                    rows[column].append((str(name.getOid()), value))
+    _observe("getbulk", start, errorIndication, errorStatus)
+    return rows
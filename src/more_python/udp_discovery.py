@@ -0,0 +1,171 @@
+# more_python/udp_discovery.py
+
+# Find which hosts answer SNMP without forking ping for every address.
+# One non-blocking UDP socket sends a sysDescr GET to every IP, replies are picked up as they
+# arrive and matched back to the IP by request-id (masscan style). Hosts that block ICMP but
+# answer SNMP show up, and hosts that ping but have SNMP off don't waste time in the slow stage.
+# The packets are built by hand (plain SNMPv1 GET) so nothing here needs pysnmp.
+# Each one waits for more_python/rate_limit.py, same as the requests snmp_client sends.
+
+import os
+import select
+import socket
+import time
+
+from more_python import metrics
+from more_python import rate_limit
+
+SYS_DESCR_OID = "1.3.6.1.2.1.1.1.0"
+DRAIN_EVERY = 64  # read replies after this many sends so the receive buffer doesn't overflow
+
+
+# ---- BER encoding, just enough for a GetRequest ----
+
+def _length(n):
+    if n < 0x80:
+        return bytes([n])
+    body = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(body)]) + body
+
+
+def _tlv(tag, payload):
+    return bytes([tag]) + _length(len(payload)) + payload
+
+
+def _integer(value):
+    return _tlv(0x02, value.to_bytes(max(1, (value.bit_length() + 8) // 8), 'big', signed=True))
+
+
+def _oid(oid):
+    parts = [int(part) for part in oid.strip('.').split('.')]
+    body = bytes([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7f]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7f))
+            part >>= 7
+        body += bytes(reversed(chunk))
+    return _tlv(0x06, body)
+
+
+def build_get_request(community, request_id, oid=SYS_DESCR_OID, version=0):
+    varbind = _tlv(0x30, _oid(oid) + b'\x05\x00')  # oid = NULL
+    pdu = _tlv(0xa0, _integer(request_id) + _integer(0) + _integer(0) + _tlv(0x30, varbind))
+    return _tlv(0x30, _integer(version) + _tlv(0x04, community.encode()) + pdu)
+
+
+# ---- BER decoding, just enough to read a GetResponse ----
+
+def _read_tlv(data, pos):
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        count = length & 0x7f
+        length = int.from_bytes(data[pos:pos + count], 'big')
+        pos += count
+    return tag, pos, pos + length
+
+
+# returns (request_id, error_status, sysDescr) or None if it isn't an SNMP response
+def parse_response(data):
+    try:
+        tag, pos, end = _read_tlv(data, 0)  # message
+        if tag != 0x30:
+            return None
+        tag, pos, value_end = _read_tlv(data, pos)  # version
+        tag, pos, value_end = _read_tlv(data, value_end)  # community
+        tag, pos, end = _read_tlv(data, value_end)  # pdu
+        if tag != 0xa2:
+            return None
+        tag, pos, value_end = _read_tlv(data, pos)
+        request_id = int.from_bytes(data[pos:value_end], 'big', signed=True)
+        tag, pos, value_end = _read_tlv(data, value_end)
+        error_status = int.from_bytes(data[pos:value_end], 'big')
+        tag, pos, value_end = _read_tlv(data, value_end)  # error index
+        tag, pos, end = _read_tlv(data, value_end)  # varbind list
+        tag, pos, end = _read_tlv(data, pos)  # first varbind
+        tag, pos, value_end = _read_tlv(data, pos)  # name
+        tag, pos, value_end = _read_tlv(data, value_end)  # value
+        descr = data[pos:value_end].decode('utf-8', 'replace') if tag == 0x04 else ""
+        return request_id, error_status, descr
+    except (IndexError, ValueError):
+        return None
+
+
+# ---- the sweep ----
+
+def _drain(sock, ids, found):
+    while True:
+        try:
+            data, (ip, _) = sock.recvfrom(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionRefusedError:
+            continue
+        reply = parse_response(data)
+        # any answer at all (even noSuchName/authorization errors) means something is listening
+        if reply and ids.get(reply[0]) == ip:
+            found.setdefault(ip, reply[2])
+
+
+def _send(sock, packet, address, ids, found):
+    rate_limit.acquire(address[0])
+    while True:
+        try:
+            sock.sendto(packet, address)
+            return
+        except (BlockingIOError, InterruptedError):
+            # send buffer is full, read what came back while it empties
+            select.select([sock], [sock], [], 0.1)
+            _drain(sock, ids, found)
+        except OSError:
+            return  # unreachable network etc, same as no answer
+
+
+# Probe every IP once (plus `retries` more times for the ones that stayed quiet).
+# Returns {ip: sysDescr} for everything that answered, the order of ips is kept.
+def discover(ips, community='public', port=161, timeout=1.0, retries=1):
+    targets = list(dict.fromkeys(ips))
+    pending = targets
+    found = {}
+    ids = {}  # request id -> ip, kept across retries so late answers still count
+    next_id = int.from_bytes(os.urandom(3), 'big')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    except OSError:
+        pass
+
+    try:
+        for attempt in range(retries + 1):
+            answered_before = len(found)
+            for count, ip in enumerate(pending):
+                next_id = (next_id + 1) & 0x7fffffff
+                ids[next_id] = ip
+                _send(sock, build_get_request(community, next_id), (ip, port), ids, found)
+                if count % DRAIN_EVERY == 0:
+                    _drain(sock, ids, found)
+
+            deadline = time.monotonic() + timeout
+            while len(found) - answered_before < len(pending):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if readable:
+                    _drain(sock, ids, found)
+
+            metrics.inc("discovery_packets", len(pending), attempt=attempt)
+            pending = [ip for ip in pending if ip not in found]
+            if not pending:
+                break
+    finally:
+        sock.close()
+
+    metrics.inc("discovery_hosts", len(found), outcome="answered")
+    metrics.inc("discovery_hosts", len(targets) - len(found), outcome="silent")
+    return {ip: found[ip] for ip in targets if ip in found}
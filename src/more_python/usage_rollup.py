@@ -0,0 +1,199 @@
+# more_python/usage_rollup.py
+
+# Pages printed per month, from the cumulative counters in the count store (count_store.py).
+#
+# A month's usage for a printer is the sum of the increases between one reading and the next,
+# counted in the month of the later reading. So the step from the last reading of March to the
+# first one of April is April's, and days with no reading just make one longer step.
+# A counter that goes down was reset (board swap, firmware): the step is then the new value,
+# what it printed since the reset.
+#
+# Everything is done on NumPy arrays (one row per reading), and the results per month are kept
+# in output/cache/usage_rollups.json with a fingerprint of the readings they came from, so only
+# months that got new readings (plus the month after them) are worked out again.
+#
+#   rollup = UsageRollup(store, cache_path)
+#   months = rollup.update()                    # {month: {"devices": ..., "models": ..., "subnets": ...}}
+#   rollup.write_csv("2026-10", path)
+
+import csv
+import json
+import os
+
+import numpy as np
+
+KINDS = ('bw', 'color')
+
+# same as PrinterReading.key: the serial, or the IP for a printer that never gave one
+KEY = "CASE WHEN serial != '' THEN serial ELSE 'ip:' || ip END"
+
+
+def subnet_of(ip):
+    return ip.rsplit('.', 1)[0] + ".0/24" if ip.count('.') == 3 else ip
+
+
+# device: int array (which printer), month: int array (month of the reading), values: float array
+# of the counter with NaN where there's no count. must be sorted by device and then time.
+# returns a (devices, months) array of pages
+def monthly_deltas(device, month, values, n_devices, n_months):
+    valid = ~np.isnan(values)
+    device, month, values = device[valid], month[valid], values[valid]
+    usage = np.zeros((n_devices, n_months))
+    if len(values) < 2:
+        return usage
+
+    same_device = device[1:] == device[:-1]
+    steps = np.diff(values)
+    # counter went down = reset, everything since the reset is the new value
+    steps = np.where(steps < 0, values[1:], steps)
+    steps = steps[same_device]
+    np.add.at(usage, (device[1:][same_device], month[1:][same_device]), steps)
+    return usage
+
+
+# roll rows of a (devices, months) array up into groups, group: one group index per device
+def group_sum(usage, group, n_groups):
+    totals = np.zeros((n_groups, usage.shape[1]))
+    np.add.at(totals, group, usage)
+    return totals
+
+
+class UsageRollup:
+    def __init__(self, store, cache_path):
+        self.store = store
+        self.cache_path = cache_path
+        self.cache = {}
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'r') as file:
+                    self.cache = json.load(file)
+            except (OSError, ValueError):
+                self.cache = {}
+
+    # {month: "count:max rowid"}, changes whenever a reading is added to (or removed from) the month
+    def fingerprints(self):
+        return {month: f"{count}:{last}" for month, count, last in self.store.db.execute(
+            "SELECT month, COUNT(*), MAX(rowid) FROM readings GROUP BY month")}
+
+    # bring the cached rollups up to date, returns {month: rollup} for every month
+    def update(self):
+        fingerprints = self.fingerprints()
+        months = sorted(fingerprints)
+
+        # a month depends on its own readings and on the last reading before it
+        def key(month):
+            index = months.index(month)
+            return fingerprints[month] + ("|" + fingerprints[months[index - 1]] if index else "")
+
+        stale = [month for month in months if self.cache.get(month, {}).get("fingerprint") != key(month)]
+        for month in list(self.cache):
+            if month not in fingerprints:
+                del self.cache[month]
+        if stale:
+            for month, rollup in self.compute(stale[0]).items():
+                if month in stale:
+                    rollup["fingerprint"] = key(month)
+                    self.cache[month] = rollup
+            self.save()
+        return {month: self.cache[month] for month in months if month in self.cache}
+
+    # rollups for every month from first_month on
+    def compute(self, first_month):
+        rows = self.store.db.execute(
+            f"SELECT {KEY}, ip, model, month, ts, bw, color FROM readings WHERE month >= ?",
+            (first_month,)).fetchall()
+        rows += self.anchors(first_month, {row[0] for row in rows})
+        if not rows:
+            return {}
+
+        serials = sorted({row[0] for row in rows})
+        months = sorted({row[3] for row in rows})
+        device_index = {serial: index for index, serial in enumerate(serials)}
+        month_index = {month: index for index, month in enumerate(months)}
+
+        device = np.array([device_index[row[0]] for row in rows], dtype=np.int64)
+        month = np.array([month_index[row[3]] for row in rows], dtype=np.int64)
+        ts = np.array([row[4] for row in rows])
+        order = np.lexsort((ts, device))
+        device, month = device[order], month[order]
+
+        # latest ip/model per printer names its subnet and model group
+        latest = {}
+        for row in sorted(rows, key=lambda row: row[4]):
+            ip, model = latest.get(row[0], ("", ""))
+            latest[row[0]] = (row[1] or ip, row[2] or model)
+        models = sorted({latest[serial][1] or "unknown" for serial in serials})
+        subnets = sorted({subnet_of(latest[serial][0]) for serial in serials})
+        model_index = {model: index for index, model in enumerate(models)}
+        subnet_index = {subnet: index for index, subnet in enumerate(subnets)}
+        model_group = np.array([model_index[latest[serial][1] or "unknown"] for serial in serials], dtype=np.int64)
+        subnet_group = np.array([subnet_index[subnet_of(latest[serial][0])] for serial in serials], dtype=np.int64)
+
+        usage = {}
+        for column, kind in ((5, 'bw'), (6, 'color')):
+            values = np.array([np.nan if row[column] is None else row[column] for row in rows], dtype=float)[order]
+            usage[kind] = monthly_deltas(device, month, values, len(serials), len(months))
+
+        # months that were only loaded for the starting readings aren't complete, leave them out
+        rollups = {}
+        for name, index in month_index.items():
+            if name < first_month:
+                continue
+            rollups[name] = {
+                "devices": {serial: {"ip": latest[serial][0], "model": latest[serial][1],
+                                     **{kind: int(usage[kind][row, index]) for kind in KINDS}}
+                            for row, serial in enumerate(serials)
+                            if any(usage[kind][row, index] for kind in KINDS)},
+                "models": self._groups(usage, model_group, models, index),
+                "subnets": self._groups(usage, subnet_group, subnets, index),
+            }
+        return rollups
+
+    # each printer's last reading with a count before first_month, so its first step has something
+    # to start from. month by month backwards until every printer has one, usually that's one month
+    def anchors(self, first_month, keys):
+        anchors = {}
+        earlier = [row[0] for row in self.store.db.execute(
+            "SELECT DISTINCT month FROM readings WHERE month < ? ORDER BY month DESC", (first_month,))]
+        for month in earlier:
+            if not keys:
+                break
+            found = {}
+            for row in self.store.db.execute(
+                    f"SELECT {KEY}, ip, model, month, ts, bw, color FROM readings "
+                    "WHERE month = ? AND (bw IS NOT NULL OR color IS NOT NULL) ORDER BY ts", (month,)):
+                if row[0] in keys:
+                    found[row[0]] = row
+            anchors.update(found)
+            keys = keys - set(found)
+        return list(anchors.values())
+
+    @staticmethod
+    def _groups(usage, group, names, index):
+        totals = {kind: group_sum(usage[kind], group, len(names))[:, index] for kind in KINDS}
+        return {name: {kind: int(totals[kind][row]) for kind in KINDS}
+                for row, name in enumerate(names) if any(totals[kind][row] for kind in KINDS)}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.cache, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.cache_path)
+
+    # one month as a flat CSV for billing: level (device/model/subnet), name, ip, model, bw, color
+    def write_csv(self, month, path):
+        rollup = self.update().get(month)
+        if rollup is None:
+            return False
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["level", "name", "ip", "model", "bw", "color"])
+            for serial, device in sorted(rollup["devices"].items(), key=lambda item: item[1]["ip"]):
+                writer.writerow(["device", serial, device["ip"], device["model"], device["bw"], device["color"]])
+            for level in ("models", "subnets"):
+                for name, totals in sorted(rollup[level].items()):
+                    writer.writerow([level[:-1], name, "", "", totals["bw"], totals["color"]])
+        os.replace(temp_path, path)
+        return True
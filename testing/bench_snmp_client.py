@@ -0,0 +1,63 @@
+# Microbenchmark: SNMP GETs/sec with a fresh SnmpEngine per request (how the scripts used to do it)
+# vs the shared engine in more_python/snmp_client.py
+#
+# usage: python3 testing/bench_snmp_client.py <ip> [port] [requests]
+# point it at a printer (or snmpd) that answers sysDescr with the "public" community
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+from pysnmp.hlapi import (
+    SnmpEngine, CommunityData, UdpTransportTarget, ContextData,
+    ObjectType, ObjectIdentity, getCmd
+)
+from more_python import snmp_client
+
+OID = "1.3.6.1.2.1.1.1.0"  # sysDescr
+COMMUNITY = "public"
+
+
+def old_get(ip, port):
+    errorIndication, errorStatus, errorIndex, varBinds = next(
+        getCmd(SnmpEngine(),
+               CommunityData(COMMUNITY, mpModel=0),
+               UdpTransportTarget((ip, port)),
+               ContextData(),
+               ObjectType(ObjectIdentity(OID)))
+    )
+    return None if errorIndication or errorStatus else str(varBinds[0][1])
+
+
+def new_get(ip, port):
+    return snmp_client.get(ip, OID, COMMUNITY, port=port)
+
+
+def run(name, func, ip, port, requests):
+    if func(ip, port) is None:
+        print(f"{name}: no answer from {ip}:{port}")
+        return None
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(ip, port)
+    elapsed = time.perf_counter() - start
+    rate = requests / elapsed
+    print(f"{name:<28}{requests} requests in {elapsed:.2f}s  ->  {rate:.1f} req/s")
+    return rate
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 bench_snmp_client.py <ip> [port] [requests]")
+        sys.exit(1)
+
+    ip = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 161
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    before = run("before (engine per GET)", old_get, ip, port, requests)
+    after = run("after (snmp_client)", new_get, ip, port, requests)
+    if before and after:
+        print(f"speedup: {after / before:.1f}x")
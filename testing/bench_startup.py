@@ -0,0 +1,96 @@
+# Startup-time benchmark for the importable API (more_python.discover / collect_counts).
+#
+# Each case runs in a fresh interpreter, a few times, and the median wall time is reported, with
+# whether pysnmp and numpy got imported and whether anything was printed or written. Importing the scripts
+# or the package is supposed to print nothing, write nothing and leave pysnmp alone until the
+# first SNMP request (and numpy until the usage rollup).
+# The scripts are imported from a temp copy of src/ so an output/ folder showing up can be seen.
+#
+# usage:
+#   python3 testing/bench_startup.py
+#   python3 testing/bench_startup.py --runs 10 --output startup.json
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TESTING_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.normpath(os.path.join(TESTING_DIR, '..'))
+
+CASES = [
+    ("python", "pass"),
+    ("import more_python", "import more_python"),
+    ("from more_python import discover, collect_counts",
+     "from more_python import discover, collect_counts"),
+    ("import _find_printers", "import _find_printers"),
+    ("import _printer_counter", "import _printer_counter"),
+    ("+ pysnmp loaded", "from more_python import collect_counts, snmp_client; snmp_client.load_pysnmp()"),
+]
+
+# appended to every case: report what it pulled in
+REPORT = "; import sys; print('pysnmp' in sys.modules, 'numpy' in sys.modules)"
+
+
+def run_case(root, code):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", code + REPORT], cwd=os.path.join(root, 'src'),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise SystemExit(f"{code!r} failed:\n{process.stdout}")
+    lines = process.stdout.strip().split("\n")
+    pysnmp, numpy = (flag == "True" for flag in lines[-1].split())
+    return seconds, pysnmp, numpy, lines[:-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="runs per case, the median is reported")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        shutil.copytree(os.path.join(REPO_DIR, 'src'), os.path.join(root, 'src'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        # one run to compile the .pyc files, so the first case doesn't pay for it
+        run_case(root, "import _find_printers, _printer_counter")
+
+        results = []
+        print(f"{'case':52} {'median ms':>10} {'min ms':>8}  pysnmp  numpy  printed")
+        for name, code in CASES:
+            times, pysnmp, numpy, printed = [], False, False, []
+            for _ in range(args.runs):
+                seconds, pysnmp, numpy, printed = run_case(root, code)
+                times.append(seconds)
+            result = {
+                "case": name,
+                "median_ms": round(statistics.median(times) * 1000, 1),
+                "min_ms": round(min(times) * 1000, 1),
+                "pysnmp": pysnmp,
+                "numpy": numpy,
+                "printed": printed,
+            }
+            results.append(result)
+            print(f"{name:52} {result['median_ms']:>10} {result['min_ms']:>8}  {'yes' if pysnmp else 'no':6}  {'yes' if numpy else 'no':5}  "
+                  f"{len(printed)} lines")
+
+        wrote = os.path.exists(os.path.join(root, 'output'))
+        print(f"output/ created by the imports: {'yes' if wrote else 'no'}")
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump({"python": sys.version.split()[0], "runs": args.runs, "results": results,
+                           "output_created": wrote}, file, indent=2)
+            print(f"results written to {args.output}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
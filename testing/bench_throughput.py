@@ -0,0 +1,180 @@
+# End-to-end throughput benchmark for the printer finder and the page counter.
+#
+# Builds a fake fleet with snmp_simulator.py on loopback, runs _find_printers.py and then
+# _printer_counter.py against it (from a temp copy of src/ with its own settings.yaml and output/,
+# so nothing in the real output folder is touched) and reports:
+#   IPs/sec, devices/sec, p50/p95/p99 per-device latency (first request -> last answer, seen by
+#   the simulator) and peak RSS of each script.
+# Results are written as JSON. --baseline compares against an older result file.
+#
+# usage:
+#   python3 testing/bench_throughput.py --prefix 24 --dead-ratio 0.8 --latency 5
+#   python3 testing/bench_throughput.py --prefix 20 --output new.json --baseline old.json
+#
+# the simulator is one python thread, for /18 and bigger it can be the slow part, not the scripts.
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import yaml
+
+TESTING_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.normpath(os.path.join(TESTING_DIR, '..'))
+sys.path.insert(0, TESTING_DIR)
+
+from snmp_simulator import Simulator, addresses_in, build_fleet
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def latency_summary(simulator):
+    latencies = [last - first for _, first, last in simulator.stats.values() if last > first]
+    return {
+        "devices": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+# run a script from the temp tree, returns (seconds, peak rss in MB, return code)
+def run_script(root, name, quiet):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'src', name)], cwd=os.path.join(root, 'src'),
+        stdout=subprocess.DEVNULL if quiet else None, stderr=subprocess.STDOUT if quiet else None)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    return elapsed, round(usage.ru_maxrss / 1024, 1), process.returncode  # ru_maxrss is KB on linux
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep/count throughput against a simulated fleet")
+    parser.add_argument('--network', default='127.64.0.0', help="loopback network to build the fleet in")
+    parser.add_argument('--prefix', type=int, default=24, help="fleet size as a prefix length, 24 to 16")
+    parser.add_argument('--dead-ratio', type=float, default=0.8, help="share of addresses with no printer")
+    parser.add_argument('--latency', type=float, default=2.0, help="per-request latency in ms")
+    parser.add_argument('--jitter', type=float, default=1.0, help="+/- random ms on the latency")
+    parser.add_argument('--loss', type=float, default=0.0, help="share of requests the simulator drops")
+    parser.add_argument('--port', type=int, default=16161)
+    parser.add_argument('--max-in-flight', type=int, default=64)
+    parser.add_argument('--counter-workers', type=int, default=16)
+    parser.add_argument('--host-discovery', default='snmp', choices=['snmp', 'ping'])
+    parser.add_argument('--skip-count', action='store_true', help="only benchmark the finder")
+    parser.add_argument('--output', help="result JSON file (default testing/bench_results/throughput-<time>.json)")
+    parser.add_argument('--baseline', help="older result JSON to compare against")
+    parser.add_argument('--verbose', action='store_true', help="show the scripts' own output")
+    args = parser.parse_args()
+
+    subnet = f"{args.network}/{args.prefix}"
+    addresses = addresses_in(subnet, args.port)
+    print(f"building fleet on {subnet}: {len(addresses)} addresses, dead ratio {args.dead_ratio}")
+    fleet = build_fleet(addresses, dead_ratio=args.dead_ratio,
+                        latency=args.latency / 1000, jitter=args.jitter / 1000, loss=args.loss)
+    simulator = Simulator(fleet).start()
+    print(f"{len(fleet)} simulated printers up")
+
+    root = tempfile.mkdtemp(prefix="printer_bench_")
+    shutil.copytree(os.path.join(REPO_DIR, 'src'), os.path.join(root, 'src'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    settings = {
+        'debug': False,
+        'snmpv1_community': 'public',
+        'DateFilenameOffset': 0,
+        'subnets': [subnet],
+        'knownprinters': [],
+        'snmp_port': args.port,
+        'host_discovery': args.host_discovery,
+        'max_in_flight': args.max_in_flight,
+        'counter_workers': args.counter_workers,
+    }
+    with open(os.path.join(root, 'settings.yaml'), 'w') as file:
+        yaml.safe_dump(settings, file)
+
+    result = {
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {**vars(args), "subnet": subnet, "addresses": len(addresses), "live_devices": len(fleet)},
+    }
+
+    try:
+        print("running _find_printers.py ...")
+        seconds, rss, code = run_script(root, '_find_printers.py', not args.verbose)
+        found = glob.glob(os.path.join(root, 'output', '*', 'foundprinters_*.csv'))
+        devices = 0
+        if found:
+            with open(found[0]) as file:
+                devices = max(0, sum(1 for _ in file) - 1)
+        result["sweep"] = {
+            "returncode": code,
+            "seconds": round(seconds, 3),
+            "ips_per_sec": round(len(addresses) / seconds, 1),
+            "devices_found": devices,
+            "devices_per_sec": round(devices / seconds, 2),
+            "latency": latency_summary(simulator),
+            "peak_rss_mb": rss,
+        }
+
+        if not args.skip_count and devices:
+            simulator.stats.clear()
+            print("running _printer_counter.py ...")
+            seconds, rss, code = run_script(root, '_printer_counter.py', not args.verbose)
+            result["count"] = {
+                "returncode": code,
+                "seconds": round(seconds, 3),
+                "devices": devices,
+                "devices_per_sec": round(devices / seconds, 2),
+                "latency": latency_summary(simulator),
+                "peak_rss_mb": rss,
+            }
+    finally:
+        simulator.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(json.dumps({key: result[key] for key in ("sweep", "count") if key in result}, indent=1))
+
+    output = args.output or os.path.join(
+        TESTING_DIR, 'bench_results', f"throughput-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=1)
+    print(f"saved {output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for phase, metric in (("sweep", "ips_per_sec"), ("sweep", "devices_per_sec"), ("count", "devices_per_sec")):
+            old = baseline.get(phase, {}).get(metric)
+            new = result.get(phase, {}).get(metric)
+            if old and new:
+                change = (new - old) / old * 100
+                flag = "  <-- slower" if change < -10 else ""
+                print(f"{phase} {metric}: {old} -> {new} ({change:+.1f}%){flag}")
+
+
+if __name__ == "__main__":
+    main()
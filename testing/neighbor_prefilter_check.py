@@ -0,0 +1,82 @@
+# Checks more_python/neighbor_prefilter.py against the neighbor tables and lease dumps in
+# testing/fixtures/, no network needed. Prints what it found and exits 1 if anything is off.
+#
+# usage:
+#   python3 testing/neighbor_prefilter_check.py
+#   python3 testing/neighbor_prefilter_check.py --arp /proc/net/arp --leases /path/to/dhcpd.leases   # just print a real one
+
+import argparse
+import os
+import sys
+
+TESTING_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES = os.path.join(TESTING_DIR, 'fixtures')
+sys.path.insert(0, os.path.normpath(os.path.join(TESTING_DIR, '..', 'src')))
+
+from more_python.neighbor_prefilter import read_arp_table, read_lease_dump, known_live, passes
+
+EXPECTED = {
+    # complete entries only: .41 never answered, .90 has no hardware address
+    'proc_net_arp.txt': {'10.1.2.1', '10.1.2.40', '10.1.2.57', '192.168.5.12'},
+    # .70 is free, .75's last entry expired
+    'dhcpd.leases': {'10.1.2.63'},
+    # .102 is incomplete, 10.1.2.300 isn't an address
+    'arp_dump.txt': {'10.1.2.101', '10.1.2.103', '10.1.2.110'},
+}
+
+
+def check(name, got, expected):
+    ok = got == expected
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: {sorted(got)}")
+    if not ok:
+        print(f"     expected {sorted(expected)}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="checks the neighbor prefilter against the fixture files")
+    parser.add_argument('--arp', help="print the live hosts in this neighbor table instead")
+    parser.add_argument('--leases', nargs='*', default=[], help="lease/ARP dumps to add to --arp")
+    args = parser.parse_args()
+
+    if args.arp:
+        live = known_live(args.arp, args.leases)
+        print(f"{len(live)} known live:")
+        for ip in sorted(live, key=lambda ip: tuple(int(part) for part in ip.split('.'))):
+            print(f"  {ip}")
+        return
+
+    ok = check('proc_net_arp.txt', read_arp_table(os.path.join(FIXTURES, 'proc_net_arp.txt')),
+               EXPECTED['proc_net_arp.txt'])
+    for name in ('dhcpd.leases', 'arp_dump.txt'):
+        ok &= check(name, read_lease_dump(os.path.join(FIXTURES, name)), EXPECTED[name])
+    ok &= check('missing table', read_arp_table(os.path.join(FIXTURES, 'nothing_here')), set())
+
+    live = known_live(os.path.join(FIXTURES, 'proc_net_arp.txt'),
+                      [os.path.join(FIXTURES, 'dhcpd.leases'), os.path.join(FIXTURES, 'arp_dump.txt')])
+    ips = [f"10.1.2.{host}" for host in range(1, 255)]
+    first = [batch for _, batch in passes(ips, live, 'first')]
+    # the gateway (.1) is skipped by the finder anyway, it doesn't make the known pass
+    ok &= check('first: known pass', set(first[0]), {ip for ip in live if ip.startswith('10.1.2.') and ip != '10.1.2.1'})
+    ok &= check('first: everything scanned once', {len(first[0]) + len(first[1])}, {len(ips)})
+    ok &= check('first: order kept', {first[0] == sorted(first[0], key=ips.index)}, {True})
+    ok &= check('only: one pass', {len(passes(ips, live, 'only'))}, {1})
+    # nothing known in a routed subnet, so it's swept in full
+    ok &= check('only: unknown subnet swept', {len(passes([f"10.9.9.{host}" for host in range(1, 255)], live, 'only')[0][1])},
+                {254})
+    ok &= check('off', {len(passes(ips, live, 'off')[0][1])}, {254})
+
+    # a local subnet where only the gateway is in the table: the gateway is skipped anyway, so it's swept in full
+    gateway_only = read_arp_table(os.path.join(FIXTURES, 'proc_net_arp_gateway_only.txt'))
+    ok &= check('gateway only table', gateway_only, {'10.1.3.1'})
+    local = [f"10.1.3.{host}" for host in range(1, 255)]
+    ok &= check('gateway only: only sweeps everything', {(passes(local, gateway_only, 'only')[0][0],
+                                                           len(passes(local, gateway_only, 'only')[0][1]))}, {("all", 254)})
+    ok &= check('gateway only: first sweeps everything', {len(passes(local, gateway_only, 'first'))}, {1})
+
+    print("all good" if ok else "some checks failed")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
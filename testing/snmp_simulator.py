@@ -0,0 +1,331 @@
+# SNMP agent simulator built from the snmpwalk captures in this folder.
+#
+# Every simulated printer gets its own loopback address (anything in 127.0.0.0/8 works on linux
+# without setting up aliases) or its own port on 127.0.0.1, and answers SNMPv1/v2c GET, GETNEXT
+# and GETBULK from one of the captures. Addresses in the range that don't get a printer stay
+# silent, like an empty IP. Latency, jitter and packet loss are configurable.
+#
+# usage:
+#   python3 testing/snmp_simulator.py --hosts 127.0.10.0/24 --dead-ratio 0.7 --port 16161 --latency 20
+#   python3 testing/snmp_simulator.py --ports 50 --port 20000        (127.0.0.1:20000-20049)
+# then point settings.yaml at it (subnets: [127.0.10.0/24], snmp_port: 16161, host_discovery: snmp)
+#
+# or from python (the benchmarks do this):
+#   sim = Simulator(build_fleet(...)); sim.start(); ...; sim.stop()
+
+import argparse
+import glob
+import heapq
+import ipaddress
+import os
+import random
+import re
+import resource
+import selectors
+import socket
+import threading
+import time
+
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api
+
+v2c = api.v2c
+
+CAPTURE_DIR = os.path.dirname(os.path.realpath(__file__))
+SESSION_GAP = 0.5  # seconds of quiet after which a request counts as a new conversation with the printer
+SERIAL_OID = (1, 3, 6, 1, 2, 1, 43, 5, 1, 1, 17, 1)
+
+_line = re.compile(r'^iso\.([\d.]+) = (?:([A-Za-z0-9-]+): ?)?(.*)$')
+
+
+def default_captures():
+    return sorted(path for path in glob.glob(os.path.join(CAPTURE_DIR, '10*'))
+                  if os.path.isfile(path))
+
+
+def _oid_tuple(text):
+    text = text.strip().strip('"')
+    if text.startswith('iso'):
+        text = '1' + text[3:]
+    elif text.startswith('ccitt'):
+        text = '0' + text[5:]
+    return tuple(int(part) for part in text.strip('.').split('.') if part)
+
+
+def _to_value(kind, text):
+    if kind is None:
+        # '= ""' is an empty string, anything else without a type is a net-snmp message
+        return v2c.OctetString('') if text == '""' else None
+    text = text.strip()
+    if kind == 'STRING':
+        return v2c.OctetString(text[1:-1] if text.startswith('"') and text.endswith('"') else text)
+    if kind == 'Hex-STRING':
+        return v2c.OctetString(hexValue=''.join(text.split()))
+    if kind == 'INTEGER':
+        match = re.search(r'-?\d+', text)
+        return v2c.Integer(int(match.group())) if match else None
+    if kind == 'Counter32':
+        return v2c.Counter32(int(text))
+    if kind == 'Counter64':
+        return v2c.Counter64(int(text))
+    if kind == 'Gauge32':
+        return v2c.Gauge32(int(text))
+    if kind == 'Timeticks':
+        return v2c.TimeTicks(int(re.search(r'\((\d+)\)', text).group(1)))
+    if kind == 'OID':
+        return v2c.ObjectIdentifier(_oid_tuple(text))
+    if kind == 'IpAddress':
+        return v2c.IpAddress(text)
+    return v2c.OctetString(text)
+
+
+# snmpwalk output -> {oid tuple: pyasn1 value}
+# lines that don't start with "iso." belong to the value above them (long Hex-STRINGs, strings with newlines)
+def parse_capture(path):
+    entries = []
+    with open(path, errors='replace') as file:
+        for raw in file:
+            line = raw.rstrip('\n')
+            match = _line.match(line)
+            if match:
+                entries.append([match.group(1), match.group(2), match.group(3)])
+            elif entries and line.strip():
+                joiner = ' ' if entries[-1][1] == 'Hex-STRING' else '\n'
+                entries[-1][2] += joiner + line.strip()
+
+    table = {}
+    for oid, kind, text in entries:
+        try:
+            value = _to_value(kind, text)
+        except ValueError:
+            value = None
+        if value is not None:
+            table[_oid_tuple('1.' + oid)] = value
+    return table
+
+
+class Agent:
+    def __init__(self, table, community='public', latency=0.0, jitter=0.0, loss=0.0):
+        self.table = table
+        self.order = sorted(table)
+        self.community = community
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+
+    def delay(self, rng):
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+    def _next(self, oid):
+        # first OID after this one in the walk order
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.order[middle] <= oid:
+                low = middle + 1
+            else:
+                high = middle
+        return self.order[low] if low < len(self.order) else None
+
+    def respond(self, message):
+        version = int(api.decodeMessageVersion(message))
+        module = api.protoModules[version]
+        request, _ = decoder.decode(message, asn1Spec=module.Message())
+        if str(module.apiMessage.getCommunity(request)) != self.community:
+            return None  # wrong community, real agents just ignore it
+
+        response = module.apiMessage.getResponse(request)
+        request_pdu = module.apiMessage.getPDU(request)
+        response_pdu = module.apiMessage.getPDU(response)
+        names = [tuple(oid) for oid, _ in module.apiPDU.getVarBinds(request_pdu)]
+        varbinds = []
+        error_index = None
+
+        if request_pdu.isSameTypeWith(module.GetRequestPDU()):
+            for index, oid in enumerate(names):
+                if oid in self.table:
+                    varbinds.append((oid, self.table[oid]))
+                elif version == 0:
+                    error_index = error_index or index + 1
+                    varbinds.append((oid, v2c.Null('')))
+                else:
+                    varbinds.append((oid, v2c.NoSuchObject('')))
+
+        elif request_pdu.isSameTypeWith(module.GetNextRequestPDU()):
+            for index, oid in enumerate(names):
+                after = self._next(oid)
+                if after is not None:
+                    varbinds.append((after, self.table[after]))
+                elif version == 0:
+                    error_index = error_index or index + 1
+                    varbinds.append((oid, v2c.Null('')))
+                else:
+                    varbinds.append((oid, v2c.EndOfMibView('')))
+
+        elif version == 1 and request_pdu.isSameTypeWith(v2c.GetBulkRequestPDU()):
+            non_repeaters = int(v2c.apiBulkPDU.getNonRepeaters(request_pdu))
+            repetitions = int(v2c.apiBulkPDU.getMaxRepetitions(request_pdu))
+            for oid in names[:non_repeaters]:
+                after = self._next(oid)
+                varbinds.append((after, self.table[after]) if after else (oid, v2c.EndOfMibView('')))
+            current = names[non_repeaters:]
+            for _ in range(repetitions):
+                if not current:
+                    break
+                row = []
+                for oid in current:
+                    after = self._next(oid)
+                    varbinds.append((after, self.table[after]) if after else (oid, v2c.EndOfMibView('')))
+                    row.append(after or oid)
+                if row == current:
+                    break  # every column ran off the end of the walk
+                current = row
+                if len(varbinds) > 60:  # stay well inside a udp datagram
+                    break
+        else:
+            return None  # SET etc, read only
+
+        module.apiPDU.setVarBinds(response_pdu, varbinds)
+        if error_index is not None:
+            module.apiPDU.setErrorStatus(response_pdu, 2)  # noSuchName
+            module.apiPDU.setErrorIndex(response_pdu, error_index)
+        return encoder.encode(response)
+
+
+# (ip, port) for every usable address in a subnet
+def addresses_in(subnet, port=16161):
+    return [(str(ip), port) for ip in ipaddress.IPv4Network(subnet, strict=False).hosts()]
+
+
+# Assign captures to (ip, port) addresses. dead_ratio of the addresses get no agent at all.
+# each printer gets its own serial so the finder/counter see them as different devices.
+def build_fleet(addresses, captures=None, dead_ratio=0.0, seed=1, **agent_options):
+    rng = random.Random(seed)
+    tables = [parse_capture(path) for path in (captures or default_captures())]
+    fleet = {}
+    for number, address in enumerate(addresses):
+        if rng.random() < dead_ratio:
+            continue
+        table = dict(tables[number % len(tables)])
+        if SERIAL_OID in table:
+            table[SERIAL_OID] = v2c.OctetString(f"{table[SERIAL_OID]}-{number}")
+        fleet[address] = Agent(table, **agent_options)
+    return fleet
+
+
+class Simulator:
+    def __init__(self, fleet, seed=1):
+        self.fleet = fleet
+        self.rng = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.queue = []  # (send at, sequence, socket, packet, address, agent address)
+        self.sequence = 0
+        self.running = False
+        self.thread = None
+        # per agent address: [requests, first request time, last response time]
+        # the first request time moves up when the printer was left alone for SESSION_GAP, so a
+        # discovery probe followed later by the real queries doesn't count as one long conversation
+        self.stats = {}
+
+    def _bind(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = len(self.fleet) + 256
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        for address in self.fleet:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(address)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, address)
+
+    def _handle(self, sock, address):
+        try:
+            message, peer = sock.recvfrom(65535)
+        except (BlockingIOError, InterruptedError):
+            return
+        agent = self.fleet[address]
+        now = time.monotonic()
+        stats = self.stats.setdefault(address, [0, now, now])
+        stats[0] += 1
+        if now - stats[2] > SESSION_GAP:
+            stats[1] = now
+        if self.rng.random() < agent.loss:
+            return
+        try:
+            reply = agent.respond(message)
+        except (PyAsn1Error, ValueError, IndexError):
+            return
+        if reply is None:
+            return
+        self.sequence += 1
+        heapq.heappush(self.queue, (now + agent.delay(self.rng), self.sequence, sock, reply, peer, address))
+
+    def _send_due(self):
+        now = time.monotonic()
+        while self.queue and self.queue[0][0] <= now:
+            _, _, sock, reply, peer, address = heapq.heappop(self.queue)
+            try:
+                sock.sendto(reply, peer)
+            except OSError:
+                continue
+            self.stats[address][2] = time.monotonic()
+
+    def serve(self):
+        self.running = True
+        while self.running:
+            timeout = 0.05
+            if self.queue:
+                timeout = max(0.0, min(timeout, self.queue[0][0] - time.monotonic()))
+            for key, _ in self.selector.select(timeout):
+                self._handle(key.fileobj, key.data)
+            self._send_due()
+
+    def start(self):
+        self._bind()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the snmpwalk captures as fake printers")
+    parser.add_argument('--hosts', default='127.0.10.0/24', help="loopback range to put printers on")
+    parser.add_argument('--ports', type=int, help="instead of --hosts: this many printers on 127.0.0.1, one port each")
+    parser.add_argument('--port', type=int, default=16161, help="udp port (first port with --ports)")
+    parser.add_argument('--dead-ratio', type=float, default=0.0, help="share of addresses that never answer")
+    parser.add_argument('--latency', type=float, default=0.0, help="response delay in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- random ms added to the delay")
+    parser.add_argument('--loss', type=float, default=0.0, help="share of requests dropped")
+    parser.add_argument('--community', default='public')
+    parser.add_argument('--captures', nargs='*', help="snmpwalk files, default is every capture in testing/")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    options = dict(community=args.community, latency=args.latency / 1000, jitter=args.jitter / 1000, loss=args.loss)
+    if args.ports:
+        addresses = [('127.0.0.1', args.port + offset) for offset in range(args.ports)]
+    else:
+        addresses = addresses_in(args.hosts, args.port)
+    fleet = build_fleet(addresses, args.captures, args.dead_ratio, args.seed, **options)
+
+    simulator = Simulator(fleet, args.seed)
+    simulator._bind()
+    print(f"serving {len(fleet)} simulated printers, ctrl-c to stop")
+    try:
+        simulator.serve()
+    except KeyboardInterrupt:
+        print("stopped")
+
+
+if __name__ == "__main__":
+    main()